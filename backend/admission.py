@@ -0,0 +1,320 @@
+import contextlib
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from hsi_loader import CHUNK_ELEMENTS
+from shared_store import SHARED_DIR_ENV
+
+logger = logging.getLogger(__name__)
+
+# Bytes that admitted analyses may hold at once in this worker, in MiB.
+# Unset uses half of the physical memory split across the workers.
+MEMORY_BUDGET_ENV = "HSI_MEMORY_BUDGET_MB"
+# Worker count uvicorn reads as the default for --workers.
+WORKERS_ENV = "WEB_CONCURRENCY"
+# Seconds a request may wait for budget before it is rejected.
+ADMISSION_TIMEOUT_ENV = "HSI_ADMISSION_TIMEOUT"
+DEFAULT_TIMEOUT = 30.0
+# Requests allowed to queue at once; further ones are rejected immediately.
+MAX_WAITING = 16
+FALLBACK_BUDGET = 2 << 30
+
+FLOAT_BYTES = 4
+INDEX_BYTES = 8
+RGB_BYTES = 3
+
+
+class AdmissionError(Exception):
+    """An operation could not be admitted under the memory budget.
+
+    ``status_code`` is 413 when the operation cannot fit even when chunked
+    and 503 when the budget stayed exhausted for the whole wait.
+    """
+
+    def __init__(self, message: str, status_code: int, decision: dict):
+        super().__init__(message)
+        self.status_code = status_code
+        self.decision = decision
+
+
+def _format_bytes(size: int) -> str:
+    value = float(size)
+    for unit in ("B", "KiB", "MiB"):
+        if value < 1024.0:
+            return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+        value /= 1024.0
+    return f"{value:.1f} GiB"
+
+
+def _physical_memory() -> Optional[int]:
+    try:
+        return int(os.sysconf("SC_PAGE_SIZE")) * int(os.sysconf("SC_PHYS_PAGES"))
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _worker_count() -> int:
+    """Workers sharing this machine's memory, for splitting the default budget.
+
+    ``WEB_CONCURRENCY`` is used when set.  Otherwise a shared directory means
+    several workers of unknown number, so the CPU count is assumed.
+    """
+
+    value = os.environ.get(WORKERS_ENV, "").strip()
+    if value:
+        try:
+            return max(1, int(value))
+        except ValueError:
+            pass
+    if os.environ.get(SHARED_DIR_ENV, "").strip():
+        logger.warning(
+            "%s is set without %s or %s; splitting the memory budget across %d workers",
+            SHARED_DIR_ENV,
+            MEMORY_BUDGET_ENV,
+            WORKERS_ENV,
+            os.cpu_count() or 1,
+        )
+        return os.cpu_count() or 1
+    return 1
+
+
+def configured_budget() -> int:
+    """Per-worker budget: ``HSI_MEMORY_BUDGET_MB`` or a share of half the RAM."""
+
+    value = os.environ.get(MEMORY_BUDGET_ENV, "").strip()
+    if value:
+        try:
+            return max(1, int(float(value) * (1 << 20)))
+        except ValueError:
+            pass
+    physical = _physical_memory()
+    total = physical // 2 if physical else FALLBACK_BUDGET
+    return max(1, total // _worker_count())
+
+
+def configured_timeout() -> float:
+    value = os.environ.get(ADMISSION_TIMEOUT_ENV, "").strip()
+    try:
+        return max(0.0, float(value)) if value else DEFAULT_TIMEOUT
+    except ValueError:
+        return DEFAULT_TIMEOUT
+
+
+def _block_rows(row_size: int, block_elements: int = CHUNK_ELEMENTS) -> int:
+    return max(1, block_elements // max(1, row_size))
+
+
+def _paths(in_memory: int, chunked: int) -> Dict[str, int]:
+    # Below one block the chunked path is the in-memory one.
+    return {"memory": in_memory, "chunked": min(chunked, in_memory)}
+
+
+def estimate_kmeans(
+    pixels: int, channels: int, clusters: int, reduced_dims: Optional[int] = None
+) -> Dict[str, int]:
+    """Peak bytes of k-means in memory and chunked.
+
+    The in-memory path holds a float32 copy of every pixel plus several
+    pixels x clusters distance temporaries; the chunked path only keeps the
+    label vector and one block of each.
+    """
+
+    dims = reduced_dims or channels
+    copy = 0 if reduced_dims else pixels * channels * FLOAT_BYTES
+    labels = pixels * (INDEX_BYTES + RGB_BYTES)
+    in_memory = (
+        copy
+        + pixels * FLOAT_BYTES
+        + labels
+        + max(3 * pixels * clusters * FLOAT_BYTES, pixels * (dims * FLOAT_BYTES + 1))
+    )
+    block = min(pixels, _block_rows(max(dims, clusters)))
+    chunked = labels + block * (2 * dims + 4 * clusters) * FLOAT_BYTES
+    return _paths(in_memory, chunked)
+
+
+def estimate_sam(
+    pixels: int,
+    width: int,
+    channels: int,
+    classes: int,
+    tile_rows: int,
+    reduced_dims: Optional[int] = None,
+) -> Dict[str, int]:
+    """Peak bytes of SAM classification in memory and chunked.
+
+    In memory the cleaned pixel matrix and the per-class selections used for
+    the summaries are full-size copies; chunked, both are built one tile at
+    a time.
+    """
+
+    cube_bytes = pixels * channels * FLOAT_BYTES
+    labels = pixels * (INDEX_BYTES + RGB_BYTES)
+    tile_pixels = min(pixels, max(1, tile_rows) * width)
+    tile = tile_pixels * classes * FLOAT_BYTES * 5
+    working = 0 if reduced_dims else cube_bytes
+    in_memory = working + labels + tile + 3 * cube_bytes
+    chunked = labels + tile + tile_pixels * (3 * channels + classes) * FLOAT_BYTES
+    return _paths(in_memory, chunked)
+
+
+def estimate_pca(pixels: int, channels: int, components: int) -> Dict[str, int]:
+    """Peak bytes of projecting every pixel onto the leading components."""
+
+    projections = pixels * components * FLOAT_BYTES
+    encoding = 3 * pixels * FLOAT_BYTES
+    in_memory = 2 * projections + encoding
+    block = min(pixels, _block_rows(channels + components))
+    chunked = projections + encoding + block * (channels + components) * FLOAT_BYTES
+    return _paths(in_memory, chunked)
+
+
+def estimate_preparation(
+    pixels: int, channels: int, pipeline_stages: int = 0, reduced_dims: Optional[int] = None
+) -> int:
+    """Bytes allocated before the analysis itself: preprocessed views and reduced cubes.
+
+    Both stay cached once built; from then on the budget counts them as
+    resident memory instead (see ``MemoryBudget``).
+    """
+
+    total = pipeline_stages * pixels * channels * FLOAT_BYTES
+    if reduced_dims:
+        total += pixels * reduced_dims * FLOAT_BYTES
+    if pipeline_stages or reduced_dims:
+        # One float64 block of the cube in flight.
+        total += min(pixels * channels, CHUNK_ELEMENTS) * 2 * INDEX_BYTES
+    return total
+
+
+def estimate_index(pixels: int, references: int) -> Dict[str, int]:
+    """Peak bytes of evaluating a band-math index and encoding its image.
+
+    Referenced bands are read one block at a time; the index image, its
+    stretched copy and the finite values kept for the summary are full-size.
+    """
+
+    block = min(pixels * max(1, references), CHUNK_ELEMENTS)
+    in_memory = 3 * pixels * FLOAT_BYTES + 2 * pixels + 2 * block * FLOAT_BYTES
+    return _paths(in_memory, in_memory)
+
+
+class MemoryBudget:
+    """Byte budget shared by concurrently running analyses.
+
+    ``admit`` picks the in-memory path when its estimate fits the free
+    budget, falls back to the chunked path when only that fits, and
+    otherwise waits up to ``timeout`` seconds for running work to finish.
+
+    ``resident`` reports bytes already held by caches, which are not free
+    for analyses.  When nothing fits, ``reclaim(needed)`` is asked to evict
+    cached data before the request starts waiting.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_waiting: int = MAX_WAITING,
+        resident: Optional[Callable[[], int]] = None,
+        reclaim: Optional[Callable[[int], int]] = None,
+    ):
+        self.capacity = int(capacity)
+        self.timeout = float(timeout)
+        self.max_waiting = int(max_waiting)
+        self.resident = resident
+        self.reclaim = reclaim
+        self._in_use = 0
+        self._waiting = 0
+        self._running = 0
+        self._condition = threading.Condition()
+
+    def snapshot(self) -> dict:
+        with self._condition:
+            return {
+                "budget_bytes": self.capacity,
+                "in_use_bytes": self._in_use,
+                "cached_bytes": self._resident(),
+                "running": self._running,
+                "waiting": self._waiting,
+            }
+
+    def _resident(self) -> int:
+        return int(self.resident()) if self.resident is not None else 0
+
+    def _pick(self, in_memory: int, chunked: int) -> Optional[str]:
+        free = self.capacity - self._in_use - self._resident()
+        if in_memory <= free:
+            return "memory"
+        if chunked <= free:
+            return "chunked"
+        if self.reclaim is not None and self.reclaim(chunked - free) > 0:
+            return self._pick(in_memory, chunked)
+        return None
+
+    @contextlib.contextmanager
+    def admit(self, operation: str, estimate: Dict[str, int]):
+        """Reserve budget for ``operation`` and yield the admission decision."""
+
+        in_memory, chunked = int(estimate["memory"]), int(estimate["chunked"])
+        decision = {
+            "operation": operation,
+            "estimated_bytes": {"memory": in_memory, "chunked": chunked},
+            "budget_bytes": self.capacity,
+        }
+        if chunked > self.capacity:
+            raise AdmissionError(
+                f"{operation} needs about {_format_bytes(chunked)} even when chunked, "
+                f"more than the {_format_bytes(self.capacity)} memory budget. "
+                "Use a spectral reduction or a smaller window.",
+                413,
+                {**decision, "path": "rejected"},
+            )
+
+        started = time.monotonic()
+        with self._condition:
+            path = self._pick(in_memory, chunked)
+            if path is None:
+                if self._waiting >= self.max_waiting:
+                    raise AdmissionError(
+                        "Server is busy; too many analyses are waiting for memory. "
+                        "Try again shortly.",
+                        503,
+                        {**decision, "path": "rejected"},
+                    )
+                self._waiting += 1
+                try:
+                    self._condition.wait_for(
+                        lambda: self._pick(in_memory, chunked) is not None,
+                        timeout=self.timeout,
+                    )
+                finally:
+                    self._waiting -= 1
+                path = self._pick(in_memory, chunked)
+                if path is None:
+                    raise AdmissionError(
+                        f"Memory budget exhausted; {operation} waited "
+                        f"{self.timeout:g} s without {_format_bytes(chunked)} becoming free. "
+                        "Try again shortly.",
+                        503,
+                        {**decision, "path": "rejected"},
+                    )
+            reserved = in_memory if path == "memory" else chunked
+            self._in_use += reserved
+            self._running += 1
+
+        decision.update(
+            path=path,
+            reserved_bytes=reserved,
+            queued_seconds=round(time.monotonic() - started, 3),
+        )
+        try:
+            yield decision
+        finally:
+            with self._condition:
+                self._in_use -= reserved
+                self._running -= 1
+                self._condition.notify_all()
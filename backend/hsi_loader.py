@@ -1,9 +1,12 @@
 import numpy as np
 from pathlib import Path
 import warnings
-from typing import Iterable, List, Optional
+from typing import Iterable, List, Optional, Tuple
 
-import spectral.io.envi as envi
+from lazy_import import LazyModule
+
+# spectral is only needed once a dataset is actually read.
+envi = LazyModule("spectral.io.envi")
 
 def _iter_hdr_files(folder: Path):
     """Yield header files in ``folder`` ignoring the case of the extension."""
@@ -63,41 +66,468 @@ def _extract_wavelengths(metadata: Optional[dict]) -> Optional[List[float]]:
     return None
 
 
-def _normalize_uncalibrated_data(data: np.ndarray) -> np.ndarray:
+STRETCH_MODES = ("minmax", "percentile", "band-minmax", "band-percentile")
+DEFAULT_PERCENTILES = (2.0, 98.0)
+HISTOGRAM_BINS = 4096
+HISTOGRAM_REFINEMENTS = 3
+CHUNK_ELEMENTS = 1 << 20
+
+
+def _iter_row_chunks(array: np.ndarray, chunk_elements: int = CHUNK_ELEMENTS):
+    """Yield views over leading-axis slices holding about ``chunk_elements`` values."""
+
+    row_size = max(1, int(np.prod(array.shape[1:], dtype=np.int64)))
+    rows = max(1, int(chunk_elements) // row_size)
+    for start in range(0, array.shape[0], rows):
+        yield array[start : start + rows]
+
+
+def _as_band_last(array: np.ndarray) -> np.ndarray:
+    """View 2-D images as single-band cubes so both share one code path."""
+
+    return array[..., np.newaxis] if array.ndim == 2 else array
+
+
+def _finite_band_min_max(array: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    bands = array.shape[-1]
+    low = np.full(bands, np.nan, dtype=np.float64)
+    high = np.full(bands, np.nan, dtype=np.float64)
+    for chunk in _iter_row_chunks(array):
+        flat = chunk.reshape(-1, bands)
+        finite = np.where(np.isfinite(flat), flat, np.nan)
+        low = np.fmin(low, np.fmin.reduce(finite, axis=0))
+        high = np.fmax(high, np.fmax.reduce(finite, axis=0))
+    return low, high
+
+
+def _chunked_histograms(
+    array: np.ndarray, ranges: List[Tuple[np.ndarray, np.ndarray]], bins: int
+) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Histogram finite values over each ``(low, high)`` range in one chunked pass.
+
+    Each entry of ``low``/``high`` defines one histogram; a single entry pools
+    every band into a global histogram.  Returns ``(counts, below, total)``
+    per range, where ``below`` counts finite values under ``low``.
+    """
+
+    bands = array.shape[-1]
+    groups = ranges[0][0].shape[0]
+    band_group = np.arange(bands) % groups
+    prepared = []
+    for low, high in ranges:
+        span = np.where(high - low > 1e-12, high - low, 1.0)
+        band_low = np.nan_to_num(low[band_group])
+        prepared.append(
+            (
+                band_low,
+                bins / span[band_group],
+                np.zeros(groups * bins, dtype=np.int64),
+                np.zeros(groups, dtype=np.int64),
+            )
+        )
+    total = np.zeros(groups, dtype=np.int64)
+    band_offset = band_group * bins
+
+    for chunk in _iter_row_chunks(array):
+        flat = chunk.reshape(-1, bands)
+        finite = np.isfinite(flat)
+        band_total = np.sum(finite, axis=0)
+        total += np.bincount(band_group, weights=band_total, minlength=groups).astype(np.int64)
+        for band_low, band_scale, counts, below in prepared:
+            scaled = np.where(finite, flat, band_low) - band_low
+            scaled *= band_scale
+            band_below = np.sum(finite & (scaled < 0), axis=0)
+            below += np.bincount(band_group, weights=band_below, minlength=groups).astype(np.int64)
+            inside = finite & (scaled >= 0) & (scaled <= bins)
+            index = np.minimum(scaled, bins - 1).astype(np.int64)
+            index += band_offset
+            counts += np.bincount(index[inside], minlength=groups * bins)
+
+    return [(counts.reshape(groups, bins), below, total) for _, _, counts, below in prepared]
+
+
+def _locate_rank(
+    counts: np.ndarray, below: np.ndarray, rank: np.ndarray, low: np.ndarray, width: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the left and right edges of the bin holding the ``rank``-th value."""
+
+    cumulative = below[:, None] + np.cumsum(counts, axis=1)
+    index = np.argmax(cumulative >= rank[:, None], axis=1)
+    left = low + index * width
+    return left, left + width
+
+
+def _is_resolved(low: np.ndarray, high: np.ndarray) -> bool:
+    width = np.nan_to_num(high - low)
+    return bool(np.all(width <= 1e-6 * np.maximum(1.0, np.abs(np.nan_to_num(low)))))
+
+
+def _histogram_percentiles(
+    array: np.ndarray,
+    low: np.ndarray,
+    high: np.ndarray,
+    percentiles: Tuple[float, float],
+    bins: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Locate percentile bounds from fixed-bin histograms built chunk by chunk.
+
+    A single hot pixel can stretch the min/max range so far that the coarse
+    histogram has no resolution left, so further passes re-bin the bin holding
+    each percentile until it is negligibly narrow.
+    """
+
+    lower_pct, upper_pct = sorted(float(p) for p in percentiles)
+    ((counts, below, total),) = _chunked_histograms(array, [(low, high)], bins)
+    lower_rank = np.maximum(1.0, np.ceil(total * (lower_pct / 100.0)))
+    upper_rank = np.maximum(1.0, np.ceil(total * (upper_pct / 100.0)))
+    width = np.where(high - low > 1e-12, high - low, 1.0) / bins
+    lower_range = _locate_rank(counts, below, lower_rank, low, width)
+    upper_range = _locate_rank(counts, below, upper_rank, low, width)
+
+    ranges = [lower_range, upper_range]
+    ranks = (lower_rank, upper_rank)
+    for _ in range(HISTOGRAM_REFINEMENTS):
+        if all(_is_resolved(range_low, range_high) for range_low, range_high in ranges):
+            break
+        refined = _chunked_histograms(array, ranges, bins)
+        ranges = [
+            _locate_rank(counts, below, rank, range_low, (range_high - range_low) / bins)
+            for (range_low, range_high), (counts, below, _), rank in zip(ranges, refined, ranks)
+        ]
+    lower, upper = (range_low for range_low, _ in ranges)
+    upper = np.minimum(upper, high)
+
+    empty = total == 0
+    lower[empty] = np.nan
+    upper[empty] = np.nan
+    return lower, upper
+
+
+def compute_stretch_bounds(
+    data: np.ndarray,
+    mode: str = "minmax",
+    percentiles: Tuple[float, float] = DEFAULT_PERCENTILES,
+    bins: int = HISTOGRAM_BINS,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return per-band ``(low, high)`` stretch bounds for ``data``.
+
+    Statistics are gathered in row chunks so no full-size temporaries are
+    allocated.  ``minmax`` and ``percentile`` pool all bands; the ``band-``
+    variants stretch each band on its own.  Percentile modes run a second
+    chunked pass to fill fixed-bin histograms over the min/max range.
+    Bands without finite values get NaN bounds.
+    """
+
+    if mode not in STRETCH_MODES:
+        raise ValueError(f"Unsupported stretch mode: {mode}")
+
+    array = _as_band_last(np.asarray(data))
+    bands = array.shape[-1]
+    low, high = _finite_band_min_max(array)
+    per_band = mode.startswith("band-")
+
+    if not per_band:
+        if np.any(np.isfinite(low)):
+            low = np.atleast_1d(np.nanmin(low))
+            high = np.atleast_1d(np.nanmax(high))
+        else:
+            low, high = low[:1], high[:1]
+
+    if mode.endswith("percentile") and np.any(np.isfinite(low)):
+        low, high = _histogram_percentiles(array, low, high, percentiles, int(bins))
+
+    if not per_band:
+        low = np.repeat(low, bands)
+        high = np.repeat(high, bands)
+    return low, high
+
+
+def apply_stretch(data: np.ndarray, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    """Rescale ``data`` in place to ``[0, 1]`` using per-band bounds.
+
+    Bands whose range is degenerate or undefined are set to zero.
+    """
+
+    array = _as_band_last(data)
+    span = high - low
+    valid = np.isfinite(span) & (span >= 1e-9)
+    scale = np.where(valid, 1.0 / np.where(valid, span, 1.0), 0.0).astype(np.float32)
+    offset = np.where(valid, low, 0.0).astype(np.float32)
+    for chunk in _iter_row_chunks(array):
+        chunk -= offset
+        chunk *= scale
+        np.clip(chunk, 0.0, 1.0, out=chunk)
+        if not np.all(valid):
+            chunk[..., ~valid] = 0.0
+    return data
+
+
+def _normalize_uncalibrated_data(
+    data: np.ndarray,
+    mode: str = "minmax",
+    percentiles: Tuple[float, float] = DEFAULT_PERCENTILES,
+    inplace: bool = False,
+) -> np.ndarray:
     """Scale raw data to ``[0, 1]`` when calibration references are missing.
 
     Without calibration the raw values can be arbitrarily large, which would be
     clipped to white by downstream RGB extraction.  This function rescales the
-    cube using the finite global min/max to preserve contrast while keeping the
-    output compatible with the rest of the pipeline.
+    cube using finite min/max or percentile bounds (see ``STRETCH_MODES``) to
+    preserve contrast while keeping the output compatible with the rest of the
+    pipeline.  With ``inplace`` a float32 input is overwritten.
     """
 
     array = np.asarray(data, dtype=np.float32)
+    if not inplace and array is data:
+        array = array.copy()
 
     if array.size == 0:
-        return np.zeros_like(array, dtype=np.float32)
+        return array
 
-    finite_mask = np.isfinite(array)
-    if not np.any(finite_mask):
-        return np.zeros_like(array, dtype=np.float32)
+    low, high = compute_stretch_bounds(array, mode=mode, percentiles=percentiles)
+    return apply_stretch(array, low, high)
 
-    finite_values = array[finite_mask]
-    min_val = float(np.min(finite_values))
-    max_val = float(np.max(finite_values))
 
-    if max_val - min_val < 1e-9:
-        return np.zeros_like(array, dtype=np.float32)
+STATS_BINS = 256
 
-    scaled = (array - min_val) / (max_val - min_val)
-    return np.clip(scaled, 0.0, 1.0, out=np.empty_like(array))
 
+def compute_band_statistics(
+    cube: np.ndarray,
+    bins: int = STATS_BINS,
+    value_range: Tuple[float, float] = (0.0, 1.0),
+) -> dict:
+    """Gather per-band min/max/mean/std and fixed-bin histograms in one pass.
 
-def load_hsi(input_path: str):
+    ``load_hsi`` always returns values in ``[0, 1]``, so a fixed histogram
+    range needs no preliminary min/max scan; finite values outside
+    ``value_range`` land in the edge bins.  Non-finite values are ignored.
+    """
+
+    array = _as_band_last(np.asarray(cube))
+    bands = array.shape[-1]
+    range_low, range_high = float(value_range[0]), float(value_range[1])
+    scale = bins / max(range_high - range_low, 1e-12)
+    offsets = np.arange(bands) * bins
+
+    count = np.zeros(bands, dtype=np.int64)
+    total = np.zeros(bands, dtype=np.float64)
+    total_sq = np.zeros(bands, dtype=np.float64)
+    low = np.full(bands, np.nan, dtype=np.float64)
+    high = np.full(bands, np.nan, dtype=np.float64)
+    counts = np.zeros(bands * bins, dtype=np.int64)
+
+    for chunk in _iter_row_chunks(array):
+        flat = chunk.reshape(-1, bands)
+        finite = np.isfinite(flat)
+        values = np.where(finite, flat, np.nan)
+        low = np.fmin(low, np.fmin.reduce(values, axis=0))
+        high = np.fmax(high, np.fmax.reduce(values, axis=0))
+        np.nan_to_num(values, copy=False, nan=0.0)
+        count += np.sum(finite, axis=0)
+        total += np.sum(values, axis=0, dtype=np.float64)
+        total_sq += np.einsum("ij,ij->j", values, values, dtype=np.float64)
+        values -= range_low
+        values *= scale
+        index = np.clip(values, 0, bins - 1).astype(np.int64)
+        index += offsets
+        counts += np.bincount(index[finite], minlength=bands * bins)
+
+    safe_count = np.maximum(count, 1)
+    mean = np.where(count > 0, total / safe_count, np.nan)
+    variance = np.maximum(total_sq / safe_count - np.nan_to_num(mean) ** 2, 0.0)
+    std = np.where(count > 0, np.sqrt(variance), np.nan)
+
+    return {
+        "count": count,
+        "min": low,
+        "max": high,
+        "mean": mean,
+        "std": std,
+        "histogram": counts.reshape(bands, bins),
+        "edges": np.linspace(range_low, range_high, bins + 1),
+    }
+
+
+def stats_percentile(stats: dict, band: int, percentile: float) -> float:
+    """Estimate a band percentile from its histogram, interpolating within a bin."""
+
+    counts = stats["histogram"][band]
+    edges = stats["edges"]
+    total = int(counts.sum())
+    if total == 0:
+        return float("nan")
+    target = total * min(max(float(percentile), 0.0), 100.0) / 100.0
+    cumulative = np.cumsum(counts)
+    index = int(np.searchsorted(cumulative, target, side="left"))
+    index = min(index, len(counts) - 1)
+    before = cumulative[index - 1] if index > 0 else 0
+    fraction = (target - before) / counts[index] if counts[index] else 0.0
+    value = edges[index] + fraction * (edges[index + 1] - edges[index])
+    return float(np.clip(value, stats["min"][band], stats["max"][band]))
+
+
+# Axis order of each ENVI interleave, expressed as positions of
+# (line, sample, band) in the file's native array.
+_INTERLEAVE_AXES = {
+    "bsq": (1, 2, 0),
+    "bil": (0, 2, 1),
+    "bip": (0, 1, 2),
+}
+
+
+def _as_index(selection):
+    """Turn an index list into an equivalent slice when it is evenly spaced."""
+
+    if isinstance(selection, slice):
+        return selection
+    indices = np.asarray(selection, dtype=np.int64)
+    if indices.size == 1:
+        return slice(int(indices[0]), int(indices[0]) + 1)
+    steps = np.diff(indices)
+    if indices.size and np.all(steps == steps[0]) and steps[0] > 0:
+        return slice(int(indices[0]), int(indices[-1]) + 1, int(steps[0]))
+    return indices
+
+
+def _selection_length(selection, size: int) -> int:
+    if isinstance(selection, slice):
+        return len(range(*selection.indices(size)))
+    return int(len(selection))
+
+
+def _resolve_window(
+    shape: Tuple[int, int, int],
+    wavelengths: Optional[List[float]],
+    window: Optional[dict] = None,
+    spatial_step: int = 1,
+    spectral_step: int = 1,
+    wavelength_range: Optional[Tuple[Optional[float], Optional[float]]] = None,
+    bands: Optional[Iterable[int]] = None,
+):
+    """Translate load options into line, sample and band selections.
+
+    ``window`` holds pixel bounds ``x0``/``x1`` (samples) and ``y0``/``y1``
+    (lines), end-exclusive and clamped to the image.  Explicit ``bands`` take
+    precedence over ``wavelength_range``; ``spectral_step`` then decimates
+    whichever band list results.
+    """
+
+    lines, samples, band_count = shape
+    spatial_step = int(spatial_step)
+    spectral_step = int(spectral_step)
+    if spatial_step < 1 or spectral_step < 1:
+        raise ValueError("Decimation steps must be positive integers")
+
+    window = window or {}
+
+    def _bounds(start_key, end_key, size):
+        start = window.get(start_key)
+        end = window.get(end_key)
+        start = 0 if start is None else max(0, min(size, int(start)))
+        end = size if end is None else max(0, min(size, int(end)))
+        if end <= start:
+            raise ValueError("Empty load window")
+        return start, end
+
+    y0, y1 = _bounds("y0", "y1", lines)
+    x0, x1 = _bounds("x0", "x1", samples)
+
+    if bands is not None:
+        band_indices = [int(b) for b in bands]
+        if any(b < 0 or b >= band_count for b in band_indices):
+            raise ValueError("Band index out of range")
+    elif wavelength_range is not None and any(v is not None for v in wavelength_range):
+        if wavelengths is None or len(wavelengths) != band_count:
+            raise ValueError("Wavelength range requires wavelength metadata")
+        low, high = wavelength_range
+        low = -np.inf if low is None else float(low)
+        high = np.inf if high is None else float(high)
+        band_indices = [i for i, wl in enumerate(wavelengths) if low <= wl <= high]
+    else:
+        band_indices = list(range(band_count))
+
+    band_indices = band_indices[::spectral_step]
+    if not band_indices:
+        raise ValueError("Band selection is empty")
+
+    return (
+        slice(y0, y1, spatial_step),
+        slice(x0, x1, spatial_step),
+        _as_index(band_indices),
+    )
+
+
+def _read_window(image, rows: slice, cols: slice, bands) -> np.ndarray:
+    """Read ``image[rows, cols, bands]`` as float32 touching only those bytes.
+
+    The file is memory-mapped in its native interleave and copied a block of
+    lines at a time, so strides follow the on-disk layout and only the pages
+    holding the selection are read.  Images that cannot be memory-mapped fall
+    back to a full load.
+    """
+
+    source = None
+    interleave = str(getattr(image, "metadata", {}).get("interleave", "bip")).lower()
+    if hasattr(image, "open_memmap") and interleave in _INTERLEAVE_AXES:
+        try:
+            source = image.open_memmap(interleave="source")
+        except Exception:
+            source = None
+
+    if source is None:
+        return np.array(np.asarray(image.load())[rows][:, cols][:, :, bands], dtype=np.float32)
+
+    line_axis, sample_axis, band_axis = _INTERLEAVE_AXES[interleave]
+    lines = source.shape[line_axis]
+    samples = source.shape[sample_axis]
+    band_count = source.shape[band_axis]
+    row_indices = range(*rows.indices(lines))
+    out = np.empty(
+        (len(row_indices), _selection_length(cols, samples), _selection_length(bands, band_count)),
+        dtype=np.float32,
+    )
+    order = (line_axis, sample_axis, band_axis)
+    row_size = max(1, out.shape[1] * out.shape[2])
+    block = max(1, CHUNK_ELEMENTS // row_size)
+
+    for start in range(0, len(row_indices), block):
+        block_rows = row_indices[start : start + block]
+        selector = [None, None, None]
+        selector[line_axis] = slice(block_rows.start, block_rows.stop, block_rows.step)
+        selector[sample_axis] = cols
+        selector[band_axis] = slice(None) if isinstance(bands, np.ndarray) else bands
+        native = source[tuple(selector)]
+        if isinstance(bands, np.ndarray):
+            native = np.take(native, bands, axis=band_axis)
+        out[start : start + len(block_rows)] = np.transpose(native, order)
+    return out
+
+
+def _image_shape(image) -> Tuple[int, int, int]:
+    shape = getattr(image, "shape", None)
+    if shape is None:
+        shape = np.shape(image.load())
+    return tuple(int(v) for v in shape)
+
+
+def load_hsi(
+    input_path: str,
+    stretch: str = "minmax",
+    window: Optional[dict] = None,
+    spatial_step: int = 1,
+    spectral_step: int = 1,
+    wavelength_range: Optional[Tuple[Optional[float], Optional[float]]] = None,
+    bands: Optional[Iterable[int]] = None,
+):
     """
     Auto-load HSI dataset (data + dark + white refs).
     input_path can be:
       - folder containing .hdr/.raw pairs
       - single .hdr or .raw file
+    stretch selects how uncalibrated data is rescaled (see STRETCH_MODES).
+    window, spatial_step, spectral_step, wavelength_range and bands restrict
+    what is read from disk (see _resolve_window); references are averaged over
+    the selected samples and bands only.
     Returns: tuple of (corrected hyperspectral cube (H, W, Bands), wavelengths list, warning)
     """
     path = Path(input_path)
@@ -120,22 +550,39 @@ def load_hsi(input_path: str):
     if data_hdr is None:
         raise FileNotFoundError("Missing data .hdr file")
 
+    if stretch not in STRETCH_MODES:
+        raise ValueError(f"Unsupported stretch mode: {stretch}")
+
     # corresponding raw file paths
     def raw_from_hdr(h): return h.with_suffix(".raw")
 
     data_img = envi.open(str(data_hdr),  str(raw_from_hdr(data_hdr)))
-    data_ref = np.array(data_img.load(), dtype=np.float32)
     wavelengths = _extract_wavelengths(getattr(data_img, "metadata", None))
+    data_shape = _image_shape(data_img)
+    rows, cols, band_sel = _resolve_window(
+        data_shape,
+        wavelengths,
+        window=window,
+        spatial_step=spatial_step,
+        spectral_step=spectral_step,
+        wavelength_range=wavelength_range,
+        bands=bands,
+    )
+    selected_bands = np.arange(data_shape[2])[band_sel].tolist()
+    data_ref = _read_window(data_img, rows, cols, band_sel)
 
     if dark_hdr and white_hdr:
-        dark_ref  = np.array(envi.open(str(dark_hdr),  str(raw_from_hdr(dark_hdr))).load(), dtype=np.float32)
-        white_ref = np.array(envi.open(str(white_hdr), str(raw_from_hdr(white_hdr))).load(), dtype=np.float32)
+        all_lines = slice(None)
+        dark_ref  = _read_window(envi.open(str(dark_hdr),  str(raw_from_hdr(dark_hdr))), all_lines, cols, band_sel)
+        white_ref = _read_window(envi.open(str(white_hdr), str(raw_from_hdr(white_hdr))), all_lines, cols, band_sel)
 
         dark_mean  = np.mean(dark_ref, axis=0)
         white_mean = np.mean(white_ref, axis=0)
 
-        corrected = (data_ref - dark_mean) / (white_mean - dark_mean + 1e-8)
-        corrected = np.clip(corrected, 0, 1)
+        corrected = data_ref
+        corrected -= dark_mean
+        corrected /= white_mean - dark_mean + 1e-8
+        np.clip(corrected, 0, 1, out=corrected)
     else:
         missing_parts = []
         if not dark_hdr:
@@ -148,22 +595,35 @@ def load_hsi(input_path: str):
         )
         warnings_list.append(calibration_warning)
         warnings.warn(calibration_warning)
-        corrected = _normalize_uncalibrated_data(data_ref)
+        corrected = _normalize_uncalibrated_data(data_ref, mode=stretch, inplace=True)
 
-    if wavelengths is None or len(wavelengths) != corrected.shape[2]:
+    if wavelengths is None or len(wavelengths) != data_shape[2]:
         metadata_warning = (
             "Wavelength metadata missing or invalid; falling back to band indices."
         )
         warnings_list.append(metadata_warning)
-        wavelengths = list(range(corrected.shape[2]))
+        wavelengths = selected_bands
         warnings.warn(metadata_warning)
+    else:
+        wavelengths = [wavelengths[i] for i in selected_bands]
 
     warning_text = "; ".join(warnings_list) if warnings_list else None
     return corrected, wavelengths, warning_text
 
-def extract_rgb(cube: np.ndarray, idxs):
-    """Extract pseudo-RGB image from cube given band indices."""
-    cube_norm = np.clip(cube, 0, 1)
-    rgb = np.stack([cube_norm[:, :, i] for i in idxs], axis=-1)
+def extract_rgb(cube: np.ndarray, idxs, bounds=None):
+    """Extract pseudo-RGB image from cube given band indices.
+
+    ``bounds`` optionally gives a ``(low, high)`` contrast stretch per channel.
+    """
+    channels = []
+    for position, i in enumerate(idxs):
+        channel = cube[:, :, i]
+        if bounds is not None:
+            low, high = bounds[position]
+            span = high - low
+            if np.isfinite(span) and span > 1e-9:
+                channel = (channel - low) / span
+        channels.append(np.clip(channel, 0, 1))
+    rgb = np.stack(channels, axis=-1)
     rgb = (rgb * 255).astype(np.uint8)
     return rgb
@@ -1,39 +1,367 @@
-from fastapi import FastAPI, Form, UploadFile, File
+from fastapi import FastAPI, Form, UploadFile, File, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from hsi_loader import load_hsi, extract_rgb
-import numpy as np, cv2, tempfile, os
+from fastapi.responses import JSONResponse, Response
+from hsi_loader import (
+    CHUNK_ELEMENTS,
+    STRETCH_MODES,
+    apply_stretch,
+    compute_band_statistics,
+    compute_stretch_bounds,
+    extract_rgb,
+    load_hsi,
+    stats_percentile,
+)
+from spectral_index import INDEX_PRESETS, compile_expression, evaluate_index, summarize_index
+from preprocessing import (
+    PIPELINE_CACHE_SIZE,
+    normalize_pipeline,
+    pipeline_key,
+    run_pipeline,
+)
+from admission import (
+    AdmissionError,
+    MemoryBudget,
+    configured_budget,
+    configured_timeout,
+    estimate_index,
+    estimate_kmeans,
+    estimate_pca,
+    estimate_preparation,
+    estimate_sam,
+)
+from shared_store import (
+    attach_dataset,
+    publish_dataset,
+    read_registry,
+    registry_mtime,
+    shared_dir,
+)
+import numpy as np, tempfile, os
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
 import math
 import shutil
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, Generator, List, Optional, Tuple
 import re
+import threading
 
 from fastapi import Request
+from lazy_import import LazyModule
+
+# OpenCV is only needed to encode images; import it on first use.
+cv2 = LazyModule("cv2")
+
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@contextlib.asynccontextmanager
+async def lifespan(_app: FastAPI):
+    _start_preload()
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Bands", "X-Tile-X0", "X-Tile-Y0", "X-Tile-Width", "X-Tile-Height"],
 )
 CUBE = None
 BANDS = None
+STATS = None
+PCA_BASIS = None
+REDUCED_CUBES: "OrderedDict[Tuple[str, int], dict]" = OrderedDict()
+ANNOTATION_CACHE: Dict[str, dict] = {}
+PIXEL_CUBE = None
+DATASET_GENERATION = None
+REGISTRY_MTIME = None
+RGB_CACHE: "OrderedDict[Tuple, str]" = OrderedDict()
+# Registered preprocessing chains by id, memoized stage results and the
+# preprocessed views (cube plus its own derived caches) built from them.
+PIPELINES: "OrderedDict[str, List[dict]]" = OrderedDict()
+PIPELINE_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+PIPELINE_VIEWS: "OrderedDict[str, dict]" = OrderedDict()
+PRELOADED: Dict[str, dict] = {}
+PRELOAD_STATUS: Dict[str, str] = {}
+# Source folder and warning of the active dataset when it came from a
+# preload, so loading the same folder again reuses it.
+ACTIVE_PRELOAD: Optional[dict] = None
+# Serializes swapping the active dataset between /load, the preload thread
+# and shared-directory syncs.
+DATASET_LOCK = threading.RLock()
+# Bumped by every dataset swap.  Requests capture it once (see
+# ``_dataset_snapshot``) and only fill the derived caches while it matches.
+DATASET_EPOCH = 0
+# Guards lookups and updates of the derived caches.  BUILD_LOCKS lets
+# concurrent requests for the same entry wait for one build.
+CACHE_LOCK = threading.RLock()
+BUILD_LOCKS: Dict[tuple, threading.Lock] = {}
+# Serializes pipeline runs so chains sharing a prefix compute it once.  The
+# stage memo itself is guarded by CACHE_LOCK, so eviction never waits on it.
+PIPELINE_LOCK = threading.Lock()
+# Memory shared by running analyses and cached arrays (see admission.py).
+MEMORY_BUDGET = MemoryBudget(
+    configured_budget(),
+    timeout=configured_timeout(),
+    resident=lambda: _cached_bytes(),
+    reclaim=lambda needed: _evict_cached(needed),
+)
 
-
-def _normalize_to_uint8(image: np.ndarray) -> np.ndarray:
-    array = np.asarray(image, dtype=np.float32)
+PREVIEW_MAX_SIDE = 256
+SAM_TILE_ROWS = 64
+PROBE_MAX_RADIUS = 16
+ANNOTATION_CACHE_SIZE = 1024
+# Encoded composites kept per dataset; percentile sweeps would otherwise add
+# one entry per distinct low/high pair.
+RGB_CACHE_SIZE = 16
+# Reduced working cubes kept per dataset (or preprocessed view).
+REDUCED_CACHE_SIZE = 4
+# Registered pipeline ids kept; the least recently used is forgotten first.
+PIPELINE_REGISTRY_SIZE = 64
+# Dataset folders to load and warm in the background at startup, separated
+# by os.pathsep.  The first one becomes the active dataset.
+PRELOAD_ENV = "HSI_PRELOAD"
+# Warmed datasets kept in memory besides the active one.  With a shared
+# directory every worker would hold a private copy, so none are kept there.
+PRELOAD_MAX_INACTIVE = 1
+DEFAULT_RGB_BANDS = (10, 20, 30)
+ADMISSION_RETRY_AFTER = 5
+
+StopCheck = Optional[Callable[[], bool]]
+
+
+def _normalize_to_uint8(image: np.ndarray, stretch: str = "minmax") -> np.ndarray:
+    array = np.array(image, dtype=np.float32)
     if array.size == 0:
         return np.zeros_like(array, dtype=np.uint8)
-    min_val = np.nanmin(array)
-    max_val = np.nanmax(array)
-    if not np.isfinite(min_val) or not np.isfinite(max_val) or max_val - min_val < 1e-9:
-        return np.zeros_like(array, dtype=np.uint8)
-    scaled = (array - min_val) / (max_val - min_val)
-    scaled = np.clip(scaled * 255.0, 0, 255)
-    return scaled.astype(np.uint8)
+    low, high = compute_stretch_bounds(array, mode=stretch)
+    apply_stretch(array, low, high)
+    np.nan_to_num(array, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+    array *= 255.0
+    return array.astype(np.uint8)
+
+
+def _reset_dataset_caches() -> None:
+    """Drop everything derived from the previously loaded cube.
+
+    The cache containers are replaced rather than cleared, so requests still
+    working on the old cube only touch the containers they captured.
+    """
+
+    global STATS, PCA_BASIS, PIXEL_CUBE, DATASET_EPOCH
+    global REDUCED_CUBES, ANNOTATION_CACHE, RGB_CACHE, PIPELINE_CACHE, PIPELINE_VIEWS
+    with DATASET_LOCK, CACHE_LOCK:
+        DATASET_EPOCH += 1
+        STATS = None
+        PCA_BASIS = None
+        PIXEL_CUBE = None
+        REDUCED_CUBES = OrderedDict()
+        ANNOTATION_CACHE = {}
+        RGB_CACHE = OrderedDict()
+        PIPELINE_CACHE = OrderedDict()
+        PIPELINE_VIEWS = OrderedDict()
+
+
+def _dataset_snapshot() -> dict:
+    """The loaded cube, its wavelengths and the caches derived from it.
+
+    Requests take one snapshot up front and use it throughout, so a dataset
+    swap halfway through cannot mix cubes.  It doubles as the view of the
+    raw cube wherever a preprocessed view is accepted.
+    """
+
+    with DATASET_LOCK:
+        return {
+            "epoch": DATASET_EPOCH,
+            "key": None,
+            "cube": CUBE,
+            "bands": BANDS,
+            "reduced": REDUCED_CUBES,
+            "annotation_cache": ANNOTATION_CACHE,
+            "rgb": RGB_CACHE,
+            "pipeline_cache": PIPELINE_CACHE,
+            "pipeline_views": PIPELINE_VIEWS,
+        }
+
+
+def _get_or_build(
+    name: tuple, epoch: int, read: Callable[[], object], write: Callable, build: Callable
+):
+    """Return a derived value, building it at most once per dataset.
+
+    ``read`` and ``write`` run under ``CACHE_LOCK``; ``build`` runs under a
+    per-entry lock, so concurrent requests wait for the first build instead
+    of repeating it.  Requests from an older dataset (``epoch`` no longer
+    current) build their value without reading or filling the cache.
+    """
+
+    key = (epoch, *name)
+    with CACHE_LOCK:
+        if epoch != DATASET_EPOCH:
+            return build()
+        value = read()
+        if value is not None:
+            return value
+        build_lock = BUILD_LOCKS.setdefault(key, threading.Lock())
+    with build_lock:
+        try:
+            with CACHE_LOCK:
+                value = read() if epoch == DATASET_EPOCH else None
+            if value is None:
+                value = build()
+                with CACHE_LOCK:
+                    if epoch == DATASET_EPOCH:
+                        write(value)
+        finally:
+            with CACHE_LOCK:
+                BUILD_LOCKS.pop(key, None)
+    return value
+
+
+def _lru_reader(cache: OrderedDict, key) -> Callable[[], object]:
+    def read():
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+    return read
+
+
+def _lru_writer(cache: OrderedDict, key, size: int) -> Callable[[object], None]:
+    def write(value):
+        cache[key] = value
+        while len(cache) > size:
+            cache.popitem(last=False)
+
+    return write
+
+
+def _sync_shared_dataset() -> None:
+    """Adopt the dataset another worker registered in the shared directory.
+
+    Only the registry's mtime is checked per request; the cube itself is
+    memory-mapped, so every worker sees the same pages without a copy.  The
+    mtime is only remembered once the registry has been handled, so a failed
+    attach (for example a generation pruned after two quick loads) is
+    retried on the next request instead of leaving the worker on the old
+    cube for good.
+    """
+
+    global CUBE, BANDS, STATS, DATASET_GENERATION, REGISTRY_MTIME, ACTIVE_PRELOAD
+    folder = shared_dir()
+    if folder is None:
+        return
+    mtime = registry_mtime(folder)
+    if mtime is None or mtime == REGISTRY_MTIME:
+        return
+    entry = read_registry(folder)
+    if entry is None:
+        return
+    if entry.get("generation") == DATASET_GENERATION:
+        REGISTRY_MTIME = mtime
+        return
+    try:
+        cube, bands, warning_text, stats = attach_dataset(folder, entry)
+    except (OSError, ValueError, KeyError) as exc:
+        logger.warning("Could not attach shared dataset %s: %s", entry.get("generation"), exc)
+        return
+    REGISTRY_MTIME = mtime
+    with DATASET_LOCK:
+        CUBE, BANDS = cube, bands
+        _reset_dataset_caches()
+        STATS = stats
+        DATASET_GENERATION = entry["generation"]
+        source = entry.get("source")
+        ACTIVE_PRELOAD = {"source": source, "warning": warning_text} if source else None
+
+
+@app.middleware("http")
+async def sync_shared_dataset(request: Request, call_next):
+    _sync_shared_dataset()
+    return await call_next(request)
+
+
+def _get_band_stats(dataset: Optional[dict] = None) -> dict:
+    """Return the per-band statistics of the loaded cube, computing them once."""
+
+    dataset = dataset if dataset is not None else _dataset_snapshot()
+
+    def write(stats):
+        global STATS
+        STATS = stats
+
+    return _get_or_build(
+        ("stats",),
+        dataset["epoch"],
+        lambda: STATS,
+        write,
+        lambda: compute_band_statistics(dataset["cube"]),
+    )
+
+
+def _render_rgb(
+    cube: np.ndarray,
+    idxs: List[int],
+    stretch: str = "none",
+    low: float = 2.0,
+    high: float = 98.0,
+    stats: Optional[dict] = None,
+) -> str:
+    bounds = None
+    if stretch == "percentile":
+        if stats is None:
+            stats = _get_band_stats()
+        bounds = [
+            (stats_percentile(stats, idx, low), stats_percentile(stats, idx, high))
+            for idx in idxs
+        ]
+    rgb = extract_rgb(cube, idxs, bounds=bounds)
+    _, buf = cv2.imencode(".jpg", rgb)
+    return buf.tobytes().hex()
+
+
+def _get_pixel_cube(dataset: Optional[dict] = None) -> np.ndarray:
+    """Return the loaded cube as C-contiguous float32 in (H, W, B) order.
+
+    That is band-interleaved-by-pixel, so each spectrum is one contiguous
+    run of bytes.  ``load_hsi`` output already qualifies and is used as is.
+    """
+
+    dataset = dataset if dataset is not None else _dataset_snapshot()
+
+    def write(cube):
+        global PIXEL_CUBE
+        PIXEL_CUBE = cube
+
+    return _get_or_build(
+        ("pixel_cube",),
+        dataset["epoch"],
+        lambda: PIXEL_CUBE,
+        write,
+        lambda: np.ascontiguousarray(dataset["cube"], dtype=np.float32),
+    )
+
+
+def _probe_tile(x: int, y: int, radius: int) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """Return the spectra around ``(x, y)`` clipped to the image, plus its origin."""
+
+    cube = _get_pixel_cube()
+    height, width = cube.shape[:2]
+    if not (0 <= x < width and 0 <= y < height):
+        raise ValueError("Pixel out of range")
+    x0, x1 = max(0, x - radius), min(width, x + radius + 1)
+    y0, y1 = max(0, y - radius), min(height, y + radius + 1)
+    return cube[y0:y1, x0:x1], (x0, y0)
 
 
 def _encode_grayscale_image(image: np.ndarray) -> str:
@@ -55,24 +383,91 @@ def _encode_rgb_image(image: np.ndarray) -> str:
     return buf.tobytes().hex()
 
 
-def _compute_pca_components(cube: np.ndarray, n_components: int) -> List[dict]:
-    height, width, channels = cube.shape
-    pixels = cube.reshape(-1, channels).astype(np.float32)
-    pixels -= pixels.mean(axis=0, keepdims=True)
-    cov = np.cov(pixels, rowvar=False)
+def _compute_pca_basis(cube: np.ndarray) -> dict:
+    """Return the band mean and eigen-decomposition of the band covariance.
+
+    The covariance is accumulated over row blocks, so no centered copy of the
+    cube is made.
+    """
+
+    channels = cube.shape[2]
+    pixels = cube.reshape(-1, channels)
+    total = pixels.shape[0]
+    band_sum = np.zeros(channels, dtype=np.float64)
+    gram = np.zeros((channels, channels), dtype=np.float64)
+    block = max(1, CHUNK_ELEMENTS // max(1, channels))
+    for start in range(0, total, block):
+        chunk = np.nan_to_num(pixels[start : start + block].astype(np.float64))
+        band_sum += chunk.sum(axis=0)
+        gram += chunk.T @ chunk
+    mean = band_sum / max(total, 1)
+    cov = (gram - total * np.outer(mean, mean)) / max(total - 1, 1)
     eigvals, eigvecs = np.linalg.eigh(cov)
     order = np.argsort(eigvals)[::-1]
     eigvals = np.clip(eigvals[order], a_min=0.0, a_max=None)
     eigvecs = eigvecs[:, order]
+    return {"mean": mean, "eigvals": eigvals, "eigvecs": eigvecs}
+
+
+def _get_pca_basis(view: Optional[dict] = None) -> dict:
+    """Return the PCA basis of the loaded cube (or a preprocessed view), computing it once."""
+
+    view = view if view is not None else _dataset_snapshot()
+    if view["key"] is None:
+
+        def read():
+            return PCA_BASIS
+
+        def write(basis):
+            global PCA_BASIS
+            PCA_BASIS = basis
+
+    else:
+
+        def read():
+            return view["pca_basis"]
+
+        def write(basis):
+            view["pca_basis"] = basis
+
+    return _get_or_build(
+        ("pca", view["key"]),
+        view["epoch"],
+        read,
+        write,
+        lambda: _compute_pca_basis(view["cube"]),
+    )
+
+
+def _compute_pca_components(
+    cube: np.ndarray,
+    n_components: int,
+    basis: Optional[dict] = None,
+    chunked: bool = False,
+) -> List[dict]:
+    height, width, channels = cube.shape
+    if basis is None:
+        basis = _compute_pca_basis(cube)
+    eigvals = basis["eigvals"]
+    eigvecs = basis["eigvecs"]
     total_variance = float(np.sum(eigvals))
     if total_variance <= 0:
         total_variance = 1.0
     results: List[dict] = []
     max_components = min(n_components, eigvecs.shape[1])
+    vectors = eigvecs[:, :max_components].astype(np.float32)
+    offsets = basis["mean"].astype(np.float32) @ vectors
+    pixels = cube.reshape(-1, channels)
+    if chunked:
+        projections = np.empty((pixels.shape[0], max_components), dtype=np.float32)
+        block = max(1, CHUNK_ELEMENTS // max(1, channels))
+        for start in range(0, pixels.shape[0], block):
+            chunk = pixels[start : start + block].astype(np.float32, copy=False)
+            projections[start : start + block] = chunk @ vectors - offsets
+    else:
+        projections = pixels @ vectors - offsets
     for comp_idx in range(max_components):
-        vector = eigvecs[:, comp_idx]
-        projection = pixels @ vector
-        image = projection.reshape(height, width)
+        image = projections[:, comp_idx].reshape(height, width)
         encoded = _encode_grayscale_image(image)
         variance_ratio = float(eigvals[comp_idx] / total_variance)
         results.append(
@@ -85,6 +480,326 @@ def _compute_pca_components(cube: np.ndarray, n_components: int) -> List[dict]:
     return results
 
 
+REDUCTION_METHODS = ("pca", "binning")
+
+
+def _build_reduced_cube(
+    cube: np.ndarray, method: str, dims: int, basis: Optional[dict] = None
+) -> dict:
+    """Project every pixel onto an orthonormal ``bands x dims`` basis.
+
+    ``pca`` uses the band mean plus the leading principal components, so
+    dot products (SAM) and Euclidean distances (k-means) in the reduced
+    space approximate the full-spectrum ones.  ``binning`` averages groups
+    of adjacent bands.  ``retained_variance`` reports the share of the
+    per-band variance kept by the projection.
+    """
+
+    height, width, channels = cube.shape
+    dims = max(1, min(int(dims), channels))
+    if method == "pca":
+        if basis is None:
+            basis = _compute_pca_basis(cube)
+        columns = np.column_stack([basis["mean"], basis["eigvecs"][:, : dims - 1]])
+        projection, _ = np.linalg.qr(columns)
+    elif method == "binning":
+        projection = np.zeros((channels, dims), dtype=np.float64)
+        for column, group in enumerate(np.array_split(np.arange(channels), dims)):
+            projection[group, column] = 1.0 / math.sqrt(len(group))
+    else:
+        raise ValueError(f"Unsupported reduction method: {method}")
+
+    projection = projection.astype(np.float32)
+    pixels = cube.reshape(-1, channels)
+    total = pixels.shape[0]
+    reduced = np.empty((total, dims), dtype=np.float32)
+    full_sum = np.zeros(channels, dtype=np.float64)
+    full_sq = np.zeros(channels, dtype=np.float64)
+    block = max(1, CHUNK_ELEMENTS // max(1, channels))
+    for start in range(0, total, block):
+        chunk = np.nan_to_num(pixels[start : start + block].astype(np.float32))
+        reduced[start : start + block] = chunk @ projection
+        full_sum += chunk.sum(axis=0, dtype=np.float64)
+        full_sq += np.einsum("ij,ij->j", chunk, chunk, dtype=np.float64)
+
+    count = max(total, 1)
+    full_variance = float(np.sum(full_sq / count - (full_sum / count) ** 2))
+    reduced_variance = float(np.sum(np.var(reduced, axis=0, dtype=np.float64)))
+    retained = reduced_variance / full_variance if full_variance > 0 else 1.0
+
+    return {
+        "method": method,
+        "dims": dims,
+        "projection": projection,
+        "pixels": reduced,
+        "retained_variance": float(min(max(retained, 0.0), 1.0)),
+    }
+
+
+def _get_reduced_cube(method: str, dims: int, view: Optional[dict] = None) -> dict:
+    """Return the cached reduced working cube for the loaded dataset or ``view``."""
+
+    view = view if view is not None else _dataset_snapshot()
+    cube, cache = view["cube"], view["reduced"]
+    key = (method, max(1, min(int(dims), cube.shape[2])))
+
+    def build():
+        basis = _get_pca_basis(view) if method == "pca" else None
+        return _build_reduced_cube(cube, method, key[1], basis=basis)
+
+    return _get_or_build(
+        ("reduced", view["key"], *key),
+        view["epoch"],
+        _lru_reader(cache, key),
+        _lru_writer(cache, key, REDUCED_CACHE_SIZE),
+        build,
+    )
+
+
+def _parse_pipeline(payload: dict) -> Optional[List[dict]]:
+    """Return the normalized stages a request refers to, or ``None`` for the raw cube.
+
+    ``pipeline`` is either the id returned by ``POST /pipelines`` or an
+    inline list of stages.
+    """
+
+    reference = payload.get("pipeline")
+    if reference is None or reference == "" or reference == []:
+        return None
+    if isinstance(reference, str):
+        with CACHE_LOCK:
+            stages = _lru_reader(PIPELINES, reference)()
+        if stages is None:
+            raise ValueError(f"Unknown pipeline: {reference}")
+        return stages
+    return normalize_pipeline(reference)
+
+
+def _get_pipeline_view(stages: Optional[List[dict]], dataset: Optional[dict] = None) -> dict:
+    """Return the preprocessed view of ``dataset`` for ``stages``.
+
+    Views are built once per stage chain and dataset; each keeps its own PCA
+    basis, reduced cubes and annotation cache since those depend on the
+    preprocessed values.  Without stages the dataset itself is the view.
+    """
+
+    dataset = dataset if dataset is not None else _dataset_snapshot()
+    if stages is None:
+        return dataset
+    key = pipeline_key(stages)
+    views = dataset["pipeline_views"]
+
+    def build():
+        source = dataset["cube"]
+        wavelengths = dataset["bands"]
+        if wavelengths is None:
+            wavelengths = list(range(source.shape[2]))
+        with PIPELINE_LOCK:
+            cube, bands = run_pipeline(
+                source, wavelengths, stages, dataset["pipeline_cache"], lock=CACHE_LOCK
+            )
+        return {
+            "epoch": dataset["epoch"],
+            "key": key,
+            "cube": cube,
+            "bands": bands,
+            "pca_basis": None,
+            "reduced": OrderedDict(),
+            "annotation_cache": {},
+        }
+
+    return _get_or_build(
+        ("view", key),
+        dataset["epoch"],
+        _lru_reader(views, key),
+        _lru_writer(views, key, PIPELINE_CACHE_SIZE),
+        build,
+    )
+
+
+def _admission_estimate(
+    operation: str,
+    stages: Optional[List[dict]],
+    reduction: Optional[Tuple[str, int]],
+    dataset: Optional[dict] = None,
+    **params,
+) -> Dict[str, int]:
+    """Estimate the peak bytes of ``operation`` on ``dataset``, per execution path.
+
+    Preprocessed views and reduced cubes that are not cached yet are counted
+    too, since the request builds them.
+    """
+
+    dataset = dataset if dataset is not None else _dataset_snapshot()
+    height, width, channels = dataset["cube"].shape
+    pixels = height * width
+    if stages is None:
+        view = dataset
+    else:
+        view = dataset["pipeline_views"].get(pipeline_key(stages))
+    pending_stages = len(stages) if stages is not None and view is None else 0
+    dims = max(1, min(int(reduction[1]), channels)) if reduction else None
+    reduced_cache = view["reduced"] if view is not None else {}
+    pending_dims = dims if reduction and (reduction[0], dims) not in reduced_cache else None
+
+    if operation == "spectra":
+        # The selected region is small next to the view it is read from.
+        estimate = {"memory": 0, "chunked": 0}
+    elif operation == "index":
+        estimate = estimate_index(pixels, params["references"])
+    elif operation == "kmeans":
+        estimate = estimate_kmeans(pixels, channels, params["clusters"], dims)
+    elif operation == "sam":
+        estimate = estimate_sam(
+            pixels, width, channels, params["classes"], params["tile_rows"], dims
+        )
+    else:
+        estimate = estimate_pca(pixels, channels, params["components"])
+    extra = estimate_preparation(pixels, channels, pending_stages, pending_dims)
+    return {path: size + extra for path, size in estimate.items()}
+
+
+def _buffer_root(array: np.ndarray) -> np.ndarray:
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+    return array
+
+
+def _cached_bytes() -> int:
+    """Bytes held by cached arrays besides the active cube.
+
+    Each underlying buffer is counted once; memory-mapped ones live in the
+    page cache and are not counted.
+    """
+
+    with CACHE_LOCK:
+        views = list(PIPELINE_VIEWS.values())
+        arrays = [PIXEL_CUBE]
+        arrays += [cube for cube, _ in PIPELINE_CACHE.values()]
+        arrays += [view["cube"] for view in views]
+        for cache in [REDUCED_CUBES] + [view["reduced"] for view in views]:
+            arrays += [reduced["pixels"] for reduced in cache.values()]
+        arrays += [entry["cube"] for entry in list(PRELOADED.values())]
+        total = sum(len(image) for image in RGB_CACHE.values())
+    seen = {id(_buffer_root(CUBE))} if CUBE is not None else set()
+    for array in arrays:
+        if array is None:
+            continue
+        root = _buffer_root(array)
+        if id(root) in seen or isinstance(root, np.memmap):
+            continue
+        seen.add(id(root))
+        total += root.nbytes
+    return total
+
+
+def _evict_steps() -> Generator:
+    """Evict one cached entry per step, cheapest to rebuild first."""
+
+    global PIXEL_CUBE
+    for cache in [REDUCED_CUBES] + [view["reduced"] for view in PIPELINE_VIEWS.values()]:
+        while cache:
+            cache.popitem(last=False)
+            yield
+    for cache in (PIPELINE_VIEWS, PIPELINE_CACHE):
+        while cache:
+            cache.popitem(last=False)
+            yield
+    if PIXEL_CUBE is not None:
+        PIXEL_CUBE = None
+        yield
+    for source in list(PRELOADED):
+        PRELOADED.pop(source, None)
+        for path in list(PRELOAD_STATUS):
+            if os.path.realpath(path) == source:
+                PRELOAD_STATUS[path] = "evicted: memory budget"
+        yield
+
+
+def _evict_cached(needed: int) -> int:
+    """Drop cached arrays until ``needed`` bytes are freed; returns the bytes freed.
+
+    Reduced cubes go first, then preprocessed views and memoized stages, the
+    contiguous pixel copy and finally warmed inactive datasets, each least
+    recently used first.  Requests still using an evicted array keep it
+    alive until they finish; their own reservation covers it.
+    """
+
+    freed = 0
+    with CACHE_LOCK:
+        before = _cached_bytes()
+        for _ in _evict_steps():
+            freed = before - _cached_bytes()
+            if freed >= needed:
+                break
+    if freed:
+        logger.info("Evicted %d cached bytes to admit an analysis", freed)
+    return freed
+
+
+def _run_admitted(
+    operation: str, estimate: Dict[str, int], compute: Callable[[bool], dict]
+) -> dict:
+    """Run ``compute(chunked)`` once the memory budget admits it.
+
+    The admission decision is added to the result under ``"admission"``.
+    """
+
+    with MEMORY_BUDGET.admit(operation, estimate) as decision:
+        result = compute(decision["path"] == "chunked")
+    return {**result, "admission": decision}
+
+
+def _admission_error_response(exc: AdmissionError) -> JSONResponse:
+    headers = {"Retry-After": str(ADMISSION_RETRY_AFTER)} if exc.status_code == 503 else None
+    return JSONResponse(
+        {"error": str(exc), "admission": exc.decision},
+        status_code=exc.status_code,
+        headers=headers,
+    )
+
+
+def _count_classes(annotations: List[dict]) -> int:
+    labels = {
+        str(annotation.get("label", "")).strip()
+        for annotation in annotations
+        if isinstance(annotation, dict)
+    }
+    return max(2, len(labels))
+
+
+def _parse_reduction(payload: dict) -> Optional[Tuple[str, int]]:
+    """Read the optional ``reduction`` request field as ``(method, dims)``."""
+
+    reduction = payload.get("reduction")
+    if not reduction:
+        return None
+    if isinstance(reduction, str):
+        reduction = {"method": reduction}
+    if not isinstance(reduction, dict):
+        raise ValueError("Invalid reduction settings")
+    method = str(reduction.get("method", "pca")).strip().lower()
+    if method not in REDUCTION_METHODS:
+        raise ValueError(f"Unsupported reduction method: {method}")
+    try:
+        dims = int(reduction.get("dims", 10))
+    except (TypeError, ValueError) as exc:
+        raise ValueError("Invalid reduction dimensionality") from exc
+    if dims < 1:
+        raise ValueError("Invalid reduction dimensionality")
+    return method, dims
+
+
+def _reduction_summary(reduced: Optional[dict]) -> Optional[dict]:
+    if reduced is None:
+        return None
+    return {
+        "method": reduced["method"],
+        "dims": reduced["dims"],
+        "retained_variance": reduced["retained_variance"],
+    }
+
+
 def _generate_palette(n_clusters: int) -> np.ndarray:
     base_colors = np.array(
         [
@@ -110,41 +825,176 @@ def _generate_palette(n_clusters: int) -> np.ndarray:
     return np.array(colors, dtype=np.uint8)
 
 
-def _compute_kmeans_segmentation(cube: np.ndarray, n_clusters: int):
+def _preview_labels(label_image: np.ndarray, max_side: int = PREVIEW_MAX_SIDE) -> np.ndarray:
+    """Decimate a label map so its longest side is at most ``max_side``."""
+
+    height, width = label_image.shape[:2]
+    step = max(1, int(math.ceil(max(height, width) / float(max_side))))
+    return label_image[::step, ::step]
+
+
+def _run_to_completion(steps: Generator):
+    """Exhaust a streaming computation and return its final result."""
+
+    while True:
+        try:
+            next(steps)
+        except StopIteration as finished:
+            return finished.value
+
+
+def _advance(steps: Generator) -> Tuple[bool, object]:
+    """Step a streaming computation, returning ``(done, event_or_result)``.
+
+    ``StopIteration`` cannot cross a thread pool boundary, so the websocket
+    handler uses this wrapper instead of calling ``next`` directly.
+    """
+
+    try:
+        return False, next(steps)
+    except StopIteration as finished:
+        return True, finished.value
+
+
+def _label_means(cube: np.ndarray, labels: np.ndarray, count: int) -> np.ndarray:
+    """Mean full-resolution spectrum of every label, read one block at a time."""
+
+    channels = cube.shape[2]
+    pixels = cube.reshape(-1, channels)
+    sums = np.zeros((count, channels), dtype=np.float64)
+    totals = np.bincount(labels, minlength=count)
+    block = max(1, CHUNK_ELEMENTS // max(1, channels, count))
+    for start in range(0, pixels.shape[0], block):
+        chunk = np.nan_to_num(pixels[start : start + block].astype(np.float32, copy=False))
+        members = (labels[start : start + block, None] == np.arange(count)).astype(np.float32)
+        sums += members.T @ chunk
+    return sums / np.maximum(totals, 1)[:, None]
+
+
+def _assign_clusters(
+    pixels: np.ndarray, centers: np.ndarray, labels: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Label pixels with their nearest center one block at a time.
+
+    Fills ``labels`` in place and returns per-cluster pixel sums and counts,
+    so no pixels x clusters matrix or float32 copy of the cube is held.
+    """
+
+    clusters = centers.shape[0]
+    center_norm = np.sum(centers * centers, axis=1)
+    sums = np.zeros(centers.shape, dtype=np.float64)
+    counts = np.zeros(clusters, dtype=np.int64)
+    block = max(1, CHUNK_ELEMENTS // max(1, pixels.shape[1], clusters))
+    for start in range(0, pixels.shape[0], block):
+        chunk = pixels[start : start + block].astype(np.float32, copy=False)
+        distances = (
+            np.sum(chunk * chunk, axis=1, keepdims=True)
+            + center_norm
+            - 2.0 * chunk @ centers.T
+        )
+        block_labels = np.argmin(distances, axis=1)
+        labels[start : start + block] = block_labels
+        members = (block_labels[:, None] == np.arange(clusters)).astype(np.float32)
+        sums += members.T @ chunk
+        counts += np.bincount(block_labels, minlength=clusters)
+    return sums, counts
+
+
+def _iter_kmeans_segmentation(
+    cube: np.ndarray,
+    n_clusters: int,
+    should_stop: StopCheck = None,
+    reduced: Optional[dict] = None,
+    bands: Optional[list] = None,
+    chunked: bool = False,
+    previews: bool = True,
+):
+    """Run k-means, yielding a progress event after every iteration.
+
+    Each event carries a low-resolution preview of the current label map and
+    the largest center movement.  When ``should_stop`` returns true the loop
+    ends early and the result is built from the current centers.  With a
+    ``reduced`` working cube (see ``_build_reduced_cube``) clustering runs in
+    that space and centroids are mapped back to spectra for the summaries.
+    ``chunked`` assigns pixels block by block (see ``_assign_clusters``)
+    instead of materializing every distance at once.  Without ``previews``
+    the events carry no map, for callers that only want the result.
+    """
+
     height, width, channels = cube.shape
-    pixels = cube.reshape(-1, channels).astype(np.float32)
+    if reduced is not None:
+        pixels = reduced["pixels"]
+    elif chunked:
+        pixels = cube.reshape(-1, channels)
+    else:
+        pixels = cube.reshape(-1, channels).astype(np.float32)
     total_pixels = pixels.shape[0]
     clusters = max(2, min(int(n_clusters), total_pixels))
     rng = np.random.default_rng(0)
     initial_indices = rng.choice(total_pixels, size=clusters, replace=False)
-    centers = pixels[initial_indices]
-    pixel_norm = np.sum(pixels * pixels, axis=1, keepdims=True)
+    centers = pixels[initial_indices].astype(np.float32)
+    if chunked:
+        labels = np.empty(total_pixels, dtype=np.int64)
+    else:
+        pixel_norm = np.sum(pixels * pixels, axis=1, keepdims=True)
+    palette = _generate_palette(clusters)
+    converged = False
+    iterations = 0
 
-    for _ in range(30):
-        center_norm = np.sum(centers * centers, axis=1)
-        distances = pixel_norm + center_norm - 2.0 * pixels @ centers.T
-        labels = np.argmin(distances, axis=1)
+    for iteration in range(30):
+        if should_stop is not None and should_stop():
+            break
+        if chunked:
+            sums, counts = _assign_clusters(pixels, centers, labels)
+        else:
+            center_norm = np.sum(centers * centers, axis=1)
+            distances = pixel_norm + center_norm - 2.0 * pixels @ centers.T
+            labels = np.argmin(distances, axis=1)
         new_centers = np.zeros_like(centers)
         for idx in range(clusters):
-            members = pixels[labels == idx]
-            if members.size == 0:
+            if chunked:
+                empty = counts[idx] == 0
+                mean = None if empty else sums[idx] / counts[idx]
+            else:
+                members = pixels[labels == idx]
+                empty = members.size == 0
+                mean = None if empty else members.mean(axis=0)
+            if empty:
                 new_centers[idx] = pixels[rng.integers(0, total_pixels)]
             else:
-                new_centers[idx] = members.mean(axis=0)
-        if np.allclose(new_centers, centers, atol=1e-4):
-            centers = new_centers
-            break
+                new_centers[idx] = mean
+        shift = float(np.max(np.linalg.norm(new_centers - centers, axis=1)))
+        converged = bool(np.allclose(new_centers, centers, atol=1e-4))
         centers = new_centers
+        iterations = iteration + 1
+        event = {
+            "type": "iteration",
+            "method": "kmeans",
+            "iteration": iterations,
+            "center_shift": shift,
+            "converged": converged,
+        }
+        if previews:
+            preview = palette[_preview_labels(labels.reshape(height, width))]
+            event["map"] = _encode_rgb_image(preview)
+        yield event
+        if converged:
+            break
 
-    center_norm = np.sum(centers * centers, axis=1)
-    distances = pixel_norm + center_norm - 2.0 * pixels @ centers.T
-    labels = np.argmin(distances, axis=1)
+    if chunked:
+        _assign_clusters(pixels, centers, labels)
+    else:
+        center_norm = np.sum(centers * centers, axis=1)
+        distances = pixel_norm + center_norm - 2.0 * pixels @ centers.T
+        labels = np.argmin(distances, axis=1)
     label_image = labels.reshape(height, width)
 
-    palette = _generate_palette(clusters)
     color_image = palette[label_image]
     encoded_map = _encode_rgb_image(color_image)
 
+    if reduced is not None:
+        centers = _label_means(cube, labels, clusters)
+
     summaries = []
     for idx in range(clusters):
         count = int(np.sum(labels == idx))
@@ -159,9 +1009,11 @@ def _compute_kmeans_segmentation(cube: np.ndarray, n_clusters: int):
             "mean": mean_value,
             "peak_band_index": peak_index,
         }
-        if BANDS is not None and len(BANDS) > peak_index:
+        if bands is None:
+            bands = BANDS
+        if bands is not None and len(bands) > peak_index:
             try:
-                summary["peak_wavelength"] = float(BANDS[peak_index])
+                summary["peak_wavelength"] = float(bands[peak_index])
             except (TypeError, ValueError):
                 summary["peak_wavelength"] = None
         summaries.append(summary)
@@ -171,9 +1023,26 @@ def _compute_kmeans_segmentation(cube: np.ndarray, n_clusters: int):
         "map": encoded_map,
         "cluster_summaries": summaries,
         "colors": palette.tolist(),
+        "iterations": iterations,
+        "converged": converged,
+        "reduction": _reduction_summary(reduced),
     }
 
 
+def _compute_kmeans_segmentation(
+    cube: np.ndarray,
+    n_clusters: int,
+    reduced: Optional[dict] = None,
+    bands: Optional[list] = None,
+    chunked: bool = False,
+):
+    return _run_to_completion(
+        _iter_kmeans_segmentation(
+            cube, n_clusters, reduced=reduced, bands=bands, chunked=chunked, previews=False
+        )
+    )
+
+
 def _normalize_rect(
     rect: dict, width: int, height: int
 ) -> Tuple[int, int, int, int]:
@@ -351,12 +1220,62 @@ def _rgb_tuple_to_hex(rgb: Tuple[int, int, int]) -> str:
     return f"#{r:02x}{g:02x}{b:02x}"
 
 
-def _classify_with_sam(cube: np.ndarray, annotations: List[dict]):
+def _annotation_key(annotation: dict) -> str:
+    """Hash an annotation's geometry; label and color are not part of the key."""
+
+    geometry = {"rect": annotation.get("rect"), "shape": annotation.get("shape")}
+    text = json.dumps(geometry, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _annotation_statistics(cube: np.ndarray, annotation: dict) -> dict:
+    """Return pixel count, per-band sum and sum of squares for one annotation."""
+
+    pixels, _ = _extract_region_pixels(cube, annotation)
+    pixels = np.nan_to_num(pixels, nan=0.0, posinf=0.0, neginf=0.0)
+    return {
+        "count": int(pixels.shape[0]),
+        "sum": pixels.sum(axis=0, dtype=np.float64),
+        "sum_sq": np.einsum("ij,ij->j", pixels, pixels, dtype=np.float64),
+    }
+
+
+def _remember_annotation(cache: Dict[str, dict], key: str, stats: dict) -> None:
+    with CACHE_LOCK:
+        while len(cache) >= ANNOTATION_CACHE_SIZE:
+            cache.pop(next(iter(cache)), None)
+        cache[key] = stats
+
+
+def _iter_sam_classification(
+    cube: np.ndarray,
+    annotations: List[dict],
+    tile_rows: int = SAM_TILE_ROWS,
+    should_stop: StopCheck = None,
+    reduced: Optional[dict] = None,
+    annotation_cache: Optional[Dict[str, dict]] = None,
+    bands: Optional[list] = None,
+    chunked: bool = False,
+    previews: bool = True,
+):
+    """Run SAM classification, yielding the label map one row tile at a time.
+
+    Training validation happens before the first tile, so invalid annotations
+    raise ``ValueError`` on the first step.  Returns ``None`` when stopped.
+    With a ``reduced`` working cube, angles are measured in that space while
+    training and classified spectra are still reported in full resolution.
+    Per-annotation sums from ``annotation_cache`` are reused so only new or
+    reshaped annotations touch the cube.  ``chunked`` cleans pixels and
+    accumulates the classified statistics tile by tile instead of copying
+    the whole cube.  Without ``previews`` the tile events carry no map.
+    """
+
     if not annotations:
         raise ValueError("Provide at least one annotated region.")
 
     class_samples: Dict[str, Dict[str, object]] = {}
     class_colors: Dict[str, Tuple[int, int, int]] = {}
+    cache_hits = 0
 
     for annotation in annotations:
         label = str(annotation.get("label", "")).strip()
@@ -369,13 +1288,28 @@ def _classify_with_sam(cube: np.ndarray, annotations: List[dict]):
         if color and label not in class_colors:
             class_colors[label] = color
 
-        pixels, _ = _extract_region_pixels(cube, annotation)
-        if pixels.size == 0:
+        key = _annotation_key(annotation)
+        stats = annotation_cache.get(key) if annotation_cache is not None else None
+        if stats is None:
+            stats = _annotation_statistics(cube, annotation)
+            if annotation_cache is not None:
+                _remember_annotation(annotation_cache, key, stats)
+        else:
+            cache_hits += 1
+        if stats["count"] == 0:
             continue
 
-        entry = class_samples.setdefault(label, {"pixels": [], "count": 0})
-        entry["pixels"].append(pixels)
-        entry["count"] = int(entry["count"]) + int(pixels.shape[0])
+        entry = class_samples.setdefault(
+            label,
+            {
+                "count": 0,
+                "sum": np.zeros_like(stats["sum"]),
+                "sum_sq": np.zeros_like(stats["sum_sq"]),
+            },
+        )
+        entry["count"] = int(entry["count"]) + int(stats["count"])
+        entry["sum"] = entry["sum"] + stats["sum"]
+        entry["sum_sq"] = entry["sum_sq"] + stats["sum_sq"]
 
     if len(class_samples) < 2:
         raise ValueError("Annotate at least two distinct classes to run classification.")
@@ -387,15 +1321,14 @@ def _classify_with_sam(cube: np.ndarray, annotations: List[dict]):
 
     for label in class_labels:
         entry = class_samples[label]
-        pixels_list = entry.get("pixels", [])
-        if not pixels_list:
+        count = int(entry["count"])
+        if count == 0:
             raise ValueError(f"No pixels found for class '{label}'.")
-        combined = np.concatenate(pixels_list, axis=0)
-        if combined.size == 0:
-            raise ValueError(f"Annotation for class '{label}' is empty.")
-        combined = np.nan_to_num(combined, nan=0.0, posinf=0.0, neginf=0.0)
-        mean_vector = combined.mean(axis=0)
-        std_vector = np.nan_to_num(combined.std(axis=0), nan=0.0, posinf=0.0, neginf=0.0)
+        mean_vector = entry["sum"] / count
+        variance = np.maximum(entry["sum_sq"] / count - mean_vector ** 2, 0.0)
+        std_vector = np.nan_to_num(np.sqrt(variance), nan=0.0, posinf=0.0, neginf=0.0)
+        mean_vector = mean_vector.astype(np.float32)
+        std_vector = std_vector.astype(np.float32)
         norm = np.linalg.norm(mean_vector)
         if not np.isfinite(norm) or norm <= 1e-12:
             raise ValueError(
@@ -410,19 +1343,17 @@ def _classify_with_sam(cube: np.ndarray, annotations: List[dict]):
 
     height, width, channels = cube.shape
     total_pixels = height * width
-    pixel_matrix = cube.reshape(-1, channels).astype(np.float32)
-    pixel_matrix = np.nan_to_num(pixel_matrix, nan=0.0, posinf=0.0, neginf=0.0)
-
-    pixel_norm = np.linalg.norm(pixel_matrix, axis=1, keepdims=True)
-    class_norm = np.linalg.norm(class_matrix, axis=1, keepdims=True)
-
-    with np.errstate(divide="ignore", invalid="ignore"):
-        denom = pixel_norm * class_norm.T
-        cos_theta = np.divide(pixel_matrix @ class_matrix.T, denom, where=denom > 0)
-    cos_theta = np.clip(cos_theta, -1.0, 1.0, out=np.zeros_like(cos_theta))
-    angles = np.arccos(cos_theta)
-    labels = np.argmin(angles, axis=1)
-    label_image = labels.reshape(height, width)
+    if reduced is None and chunked:
+        pixel_matrix = cube.reshape(-1, channels)
+        spectra_matrix = pixel_matrix
+    elif reduced is None:
+        pixel_matrix = cube.reshape(-1, channels).astype(np.float32)
+        pixel_matrix = np.nan_to_num(pixel_matrix, nan=0.0, posinf=0.0, neginf=0.0)
+        spectra_matrix = pixel_matrix
+    else:
+        class_matrix = class_matrix @ reduced["projection"]
+        pixel_matrix = reduced["pixels"]
+        spectra_matrix = cube.reshape(-1, channels)
 
     palette = _generate_palette(len(class_labels))
     color_list = []
@@ -432,8 +1363,60 @@ def _classify_with_sam(cube: np.ndarray, annotations: List[dict]):
             palette_color = palette[idx].tolist()
             color = (int(palette_color[0]), int(palette_color[1]), int(palette_color[2]))
         color_list.append(color)
-
     color_array = np.array(color_list, dtype=np.uint8)
+
+    class_norm = np.linalg.norm(class_matrix, axis=1, keepdims=True)
+    labels = np.zeros(total_pixels, dtype=np.int64)
+    rows_per_tile = max(1, int(tile_rows))
+    class_count = np.zeros(len(class_labels), dtype=np.int64)
+    class_sum = np.zeros((len(class_labels), channels), dtype=np.float64)
+    class_sq = np.zeros((len(class_labels), channels), dtype=np.float64)
+
+    for row_start in range(0, height, rows_per_tile):
+        if should_stop is not None and should_stop():
+            return None
+        row_end = min(height, row_start + rows_per_tile)
+        tile = pixel_matrix[row_start * width : row_end * width]
+        if chunked and reduced is None:
+            tile = np.nan_to_num(tile.astype(np.float32), nan=0.0, posinf=0.0, neginf=0.0)
+        pixel_norm = np.linalg.norm(tile, axis=1, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            denom = pixel_norm * class_norm.T
+            products = tile @ class_matrix.T
+            # Zero-norm pixels (e.g. cleaned NaNs) keep a cosine of 0.
+            cos_theta = np.divide(
+                products, denom, out=np.zeros_like(products), where=denom > 0
+            )
+        np.clip(cos_theta, -1.0, 1.0, out=cos_theta)
+        angles = np.arccos(cos_theta)
+        tile_labels = np.argmin(angles, axis=1)
+        labels[row_start * width : row_end * width] = tile_labels
+        if chunked:
+            spectra = tile
+            if reduced is not None:
+                spectra = np.nan_to_num(
+                    spectra_matrix[row_start * width : row_end * width].astype(np.float32),
+                    nan=0.0,
+                    posinf=0.0,
+                    neginf=0.0,
+                )
+            members = (tile_labels[:, None] == np.arange(len(class_labels))).astype(
+                np.float32
+            )
+            class_count += np.bincount(tile_labels, minlength=len(class_labels))
+            class_sum += members.T @ spectra
+            class_sq += members.T @ (spectra * spectra)
+        event = {
+            "type": "tile",
+            "method": "sam",
+            "rows": [row_start, row_end],
+            "progress": float(row_end / height) if height else 1.0,
+        }
+        if previews:
+            event["map"] = _encode_rgb_image(color_array[tile_labels.reshape(-1, width)])
+        yield event
+
+    label_image = labels.reshape(height, width)
     color_image = color_array[label_image]
     encoded_map = _encode_rgb_image(color_image)
 
@@ -443,8 +1426,18 @@ def _classify_with_sam(cube: np.ndarray, annotations: List[dict]):
         classified_count = int(mask.sum())
         classified_mean = None
         classified_std = None
-        if classified_count > 0:
-            classified_pixels = pixel_matrix[mask]
+        if classified_count > 0 and chunked:
+            mean_vector = class_sum[idx] / class_count[idx]
+            variance = np.maximum(class_sq[idx] / class_count[idx] - mean_vector ** 2, 0.0)
+            classified_mean = np.nan_to_num(mean_vector, nan=0.0).tolist()
+            classified_std = np.nan_to_num(np.sqrt(variance), nan=0.0).tolist()
+        elif classified_count > 0:
+            # Without a reduction the pixel matrix is already cleaned float32.
+            classified_pixels = spectra_matrix[mask]
+            if reduced is not None:
+                classified_pixels = np.nan_to_num(
+                    classified_pixels.astype(np.float32), nan=0.0, posinf=0.0, neginf=0.0
+                )
             classified_mean = classified_pixels.mean(axis=0)
             classified_mean = np.nan_to_num(classified_mean, nan=0.0).tolist()
             std_vector = np.nan_to_num(classified_pixels.std(axis=0), nan=0.0)
@@ -471,20 +1464,212 @@ def _classify_with_sam(cube: np.ndarray, annotations: List[dict]):
         "method": "sam",
         "map": encoded_map,
         "classes": summaries,
-        "bands": BANDS,
+        "bands": bands if bands is not None else BANDS,
         "total_pixels": total_pixels,
+        "reduction": _reduction_summary(reduced),
+        "training_cache": {
+            "reused": cache_hits,
+            "extracted": len(annotations) - cache_hits,
+        },
+    }
+
+
+def _classify_with_sam(
+    cube: np.ndarray,
+    annotations: List[dict],
+    reduced: Optional[dict] = None,
+    annotation_cache: Optional[Dict[str, dict]] = None,
+    bands: Optional[list] = None,
+    chunked: bool = False,
+):
+    return _run_to_completion(
+        _iter_sam_classification(
+            cube,
+            annotations,
+            reduced=reduced,
+            annotation_cache=annotation_cache,
+            bands=bands,
+            chunked=chunked,
+            previews=False,
+        )
+    )
+
+def _preload_paths() -> List[str]:
+    value = os.environ.get(PRELOAD_ENV, "")
+    return [item.strip() for item in value.split(os.pathsep) if item.strip()]
+
+
+def _warm_dataset(path: str) -> dict:
+    """Load a dataset and build the caches a first user would otherwise pay for."""
+
+    cube, bands, warning_text = load_hsi(path)
+    stats = compute_band_statistics(cube)
+    basis = _compute_pca_basis(cube)
+    idxs = [min(idx, cube.shape[2] - 1) for idx in DEFAULT_RGB_BANDS]
+    rgb = {(*idxs, "none"): _render_rgb(cube, idxs, stats=stats)}
+    return {
+        "source": os.path.realpath(path),
+        "cube": cube,
+        "bands": bands,
+        "warning": warning_text,
+        "stats": stats,
+        "pca_basis": basis,
+        "rgb": rgb,
     }
 
+
+def _activate_preloaded(entry: dict) -> None:
+    """Make a warmed dataset the active one, publishing it when sharing is on.
+
+    The caller holds ``DATASET_LOCK``.  The entry is dropped from
+    ``PRELOADED`` since the active dataset now owns its arrays.
+    """
+
+    global CUBE, BANDS, STATS, PCA_BASIS, DATASET_GENERATION, ACTIVE_PRELOAD
+    cube = entry["cube"]
+    folder = shared_dir()
+    if folder is not None:
+        DATASET_GENERATION, cube = publish_dataset(
+            folder, cube, entry["bands"], entry["warning"], entry["stats"], entry["source"]
+        )
+    CUBE, BANDS = cube, entry["bands"]
+    _reset_dataset_caches()
+    STATS = entry["stats"]
+    PCA_BASIS = entry["pca_basis"]
+    with CACHE_LOCK:
+        RGB_CACHE.update(entry["rgb"])
+    ACTIVE_PRELOAD = {"source": entry["source"], "warning": entry["warning"]}
+    PRELOADED.pop(entry["source"], None)
+
+
+def _adopt_shared_preload(key: str) -> bool:
+    """Attach the dataset another worker already preloaded from ``key``."""
+
+    global ACTIVE_PRELOAD
+    folder = shared_dir()
+    entry = read_registry(folder) if folder is not None else None
+    if entry is None or entry.get("source") != key:
+        return False
+    _sync_shared_dataset()
+    if DATASET_GENERATION != entry["generation"]:
+        return False
+    ACTIVE_PRELOAD = {"source": key, "warning": entry.get("warning")}
+    return True
+
+
+def _run_preload(paths: List[str]) -> None:
+    """Warm ``paths`` in order; the first becomes active unless a dataset is loaded.
+
+    At most ``PRELOAD_MAX_INACTIVE`` other datasets stay warm.  With a shared
+    directory the first dataset is published (or adopted when another worker
+    already did) and no private copies are kept.
+    """
+
+    keep_inactive = 0 if shared_dir() is not None else PRELOAD_MAX_INACTIVE
+    for position, path in enumerate(paths):
+        key = os.path.realpath(path)
+        if position > 0 and len(PRELOADED) >= keep_inactive:
+            PRELOAD_STATUS[path] = "skipped: preload limit reached"
+            continue
+        if position == 0 and CUBE is None and _adopt_shared_preload(key):
+            PRELOAD_STATUS[path] = "ready"
+            continue
+        PRELOAD_STATUS[path] = "loading"
+        try:
+            entry = _warm_dataset(path)
+        except Exception as exc:
+            PRELOAD_STATUS[path] = f"error: {exc}"
+            continue
+        with DATASET_LOCK:
+            activated = position == 0 and CUBE is None
+            if activated:
+                _activate_preloaded(entry)
+        if activated:
+            PRELOAD_STATUS[path] = "ready"
+        elif len(PRELOADED) < keep_inactive:
+            PRELOADED[key] = entry
+            PRELOAD_STATUS[path] = "ready"
+        else:
+            PRELOAD_STATUS[path] = "skipped: preload limit reached"
+
+
+def _start_preload() -> Optional[threading.Thread]:
+    """Warm the configured datasets without delaying server startup."""
+
+    paths = _preload_paths()
+    if not paths:
+        return None
+    for path in paths:
+        PRELOAD_STATUS[path] = "pending"
+    thread = threading.Thread(
+        target=_run_preload, args=(paths,), name="hsi-preload", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+@app.get("/health")
+def get_health():
+    """Liveness: the process is up and serving requests."""
+
+    return {"status": "ok"}
+
+
+@app.get("/admission")
+def get_admission():
+    """Current memory budget use of running and queued analyses and of caches."""
+
+    return MEMORY_BUDGET.snapshot()
+
+
+@app.get("/ready")
+def get_readiness():
+    """Readiness: every configured preload has finished (or failed)."""
+
+    pending = [
+        path for path, status in PRELOAD_STATUS.items() if status in {"pending", "loading"}
+    ]
+    body = {
+        "ready": not pending,
+        "dataset_loaded": CUBE is not None,
+        "preload": dict(PRELOAD_STATUS),
+    }
+    return JSONResponse(body, status_code=200 if not pending else 503)
+
+
 @app.post("/load")
 async def load_dataset(
     folder_path: Optional[str] = Form(None),
     files: Optional[List[UploadFile]] = File(None),
+    stretch: str = Form("minmax"),
+    x0: Optional[int] = Form(None),
+    x1: Optional[int] = Form(None),
+    y0: Optional[int] = Form(None),
+    y1: Optional[int] = Form(None),
+    spatial_step: int = Form(1),
+    spectral_step: int = Form(1),
+    wavelength_min: Optional[float] = Form(None),
+    wavelength_max: Optional[float] = Form(None),
+    bands: Optional[str] = Form(None),
 ):
-    global CUBE, BANDS
+    global CUBE, BANDS, STATS, DATASET_GENERATION, ACTIVE_PRELOAD
 
     temp_dir = None
     load_target = None
 
+    stretch = stretch.strip().lower()
+    if stretch not in STRETCH_MODES:
+        return JSONResponse(
+            {"error": f"Unsupported stretch mode: {stretch}"}, status_code=400
+        )
+
+    band_list = None
+    if bands:
+        try:
+            band_list = [int(item) for item in bands.replace(";", ",").split(",") if item.strip()]
+        except ValueError:
+            return JSONResponse({"error": "Invalid band list"}, status_code=400)
+
     try:
         if files:
             temp_dir = tempfile.mkdtemp(prefix="hsi_upload_")
@@ -502,6 +1687,29 @@ async def load_dataset(
                 return JSONResponse(
                     {"error": f"Path not found: {folder_path}"}, status_code=400
                 )
+            source = os.path.realpath(folder_path)
+            default_window = (
+                stretch == "minmax"
+                and band_list is None
+                and spatial_step == 1
+                and spectral_step == 1
+                and all(v is None for v in (x0, x1, y0, y1, wavelength_min, wavelength_max))
+            )
+            if default_window:
+                with DATASET_LOCK:
+                    reuse = (
+                        CUBE is not None
+                        and ACTIVE_PRELOAD is not None
+                        and ACTIVE_PRELOAD["source"] == source
+                    )
+                    preloaded = None if reuse else PRELOADED.get(source)
+                    if preloaded is not None:
+                        _activate_preloaded(preloaded)
+                    if reuse or preloaded is not None:
+                        response = {"bands": BANDS, "shape": CUBE.shape}
+                        if ACTIVE_PRELOAD["warning"]:
+                            response["warning"] = ACTIVE_PRELOAD["warning"]
+                        return response
             load_target = folder_path
         else:
             return JSONResponse(
@@ -509,8 +1717,28 @@ async def load_dataset(
                 status_code=400,
             )
 
-        CUBE, BANDS, warning_text = load_hsi(load_target)
-    except FileNotFoundError as exc:
+        cube, bands, warning_text = load_hsi(
+            load_target,
+            stretch=stretch,
+            window={"x0": x0, "x1": x1, "y0": y0, "y1": y1},
+            spatial_step=spatial_step,
+            spectral_step=spectral_step,
+            wavelength_range=(wavelength_min, wavelength_max),
+            bands=band_list,
+        )
+        stats = compute_band_statistics(cube)
+        folder = shared_dir()
+        generation = None
+        if folder is not None:
+            generation, cube = publish_dataset(folder, cube, bands, warning_text, stats)
+        with DATASET_LOCK:
+            CUBE, BANDS = cube, bands
+            _reset_dataset_caches()
+            STATS = stats
+            ACTIVE_PRELOAD = None
+            if generation is not None:
+                DATASET_GENERATION = generation
+    except (FileNotFoundError, ValueError) as exc:
         return JSONResponse({"error": str(exc)}, status_code=400)
     except Exception as exc:
         return JSONResponse({"error": f"Failed to load dataset: {exc}"}, status_code=500)
@@ -524,40 +1752,170 @@ async def load_dataset(
     return response
 
 @app.get("/rgb")
-def get_rgb(r: int = 10, g: int = 20, b: int = 30):
-    if CUBE is None:
+def get_rgb(
+    r: int = 10,
+    g: int = 20,
+    b: int = 30,
+    stretch: str = "none",
+    low: float = 2.0,
+    high: float = 98.0,
+):
+    dataset = _dataset_snapshot()
+    if dataset["cube"] is None:
         return JSONResponse({"error": "No cube loaded"}, status_code=400)
-    rgb = extract_rgb(CUBE, [r, g, b])
-    _, buf = cv2.imencode(".jpg", rgb)
-    return {"image": buf.tobytes().hex()}
+    stretch = stretch.strip().lower()
+    if stretch not in {"none", "percentile"}:
+        return JSONResponse(
+            {"error": f"Unsupported stretch mode: {stretch}"}, status_code=400
+        )
+    key = (r, g, b, stretch, low, high) if stretch == "percentile" else (r, g, b, stretch)
+
+    def render():
+        stats = _get_band_stats(dataset) if stretch == "percentile" else None
+        return _render_rgb(dataset["cube"], [r, g, b], stretch, low, high, stats=stats)
+
+    image = _get_or_build(
+        ("rgb", *key),
+        dataset["epoch"],
+        _lru_reader(dataset["rgb"], key),
+        _lru_writer(dataset["rgb"], key, RGB_CACHE_SIZE),
+        render,
+    )
+    return {"image": image}
+
+
+@app.get("/stats")
+def get_stats(histogram: bool = True):
+    dataset = _dataset_snapshot()
+    if dataset["cube"] is None:
+        return JSONResponse({"error": "No cube loaded"}, status_code=400)
+    stats = _get_band_stats(dataset)
+
+    def _to_list(values):
+        return [float(v) if np.isfinite(v) else None for v in values]
+
+    response = {
+        "bands": dataset["bands"],
+        "count": stats["count"].tolist(),
+        "min": _to_list(stats["min"]),
+        "max": _to_list(stats["max"]),
+        "mean": _to_list(stats["mean"]),
+        "std": _to_list(stats["std"]),
+    }
+    if histogram:
+        response["histogram"] = {
+            "edges": stats["edges"].tolist(),
+            "counts": stats["histogram"].tolist(),
+        }
+    return response
 
 
 @app.post("/spectra")
 async def get_spectra(req: Request):
-    if CUBE is None:
+    dataset = _dataset_snapshot()
+    if dataset["cube"] is None:
         return JSONResponse({"error": "No cube loaded"}, status_code=400)
     data = await req.json()
     region = {"rect": data.get("rect"), "shape": data.get("shape")}
     if region["rect"] is None and region["shape"] is None:
         return JSONResponse({"error": "No region"}, status_code=400)
 
+    def compute_spectra(_chunked: bool) -> dict:
+        view = _get_pipeline_view(stages, dataset)
+        pixels, _ = _extract_region_pixels(view["cube"], region)
+        if pixels.size == 0:
+            raise ValueError("Empty selection")
+        pixels = np.nan_to_num(pixels, nan=0.0, posinf=0.0, neginf=0.0)
+        mean_spec = pixels.mean(axis=0).tolist()
+        std_spec = np.nan_to_num(pixels.std(axis=0), nan=0.0, posinf=0.0, neginf=0.0).tolist()
+        return {"spectra": mean_spec, "stddev": std_spec, "bands": view["bands"]}
+
     try:
-        pixels, _ = _extract_region_pixels(CUBE, region)
+        stages = _parse_pipeline(data)
+        if stages is None:
+            return compute_spectra(False)
+        # Building a preprocessed view allocates full cubes, so it is admitted.
+        estimate = _admission_estimate("spectra", stages, None, dataset)
+        return await run_in_threadpool(_run_admitted, "spectra", estimate, compute_spectra)
+    except AdmissionError as exc:
+        return _admission_error_response(exc)
     except ValueError as exc:
         return JSONResponse({"error": str(exc)}, status_code=400)
 
-    if pixels.size == 0:
-        return JSONResponse({"error": "Empty selection"}, status_code=400)
 
-    pixels = np.nan_to_num(pixels, nan=0.0, posinf=0.0, neginf=0.0)
-    mean_spec = pixels.mean(axis=0).tolist()
-    std_spec = np.nan_to_num(pixels.std(axis=0), nan=0.0, posinf=0.0, neginf=0.0).tolist()
-    return {"spectra": mean_spec, "stddev": std_spec, "bands": BANDS}
+@app.get("/pixel")
+def get_pixel_spectrum(x: int, y: int):
+    """Return one pixel's spectrum as raw little-endian float32 bytes."""
+
+    if CUBE is None:
+        return JSONResponse({"error": "No cube loaded"}, status_code=400)
+    try:
+        tile, _ = _probe_tile(x, y, 0)
+    except ValueError as exc:
+        return JSONResponse({"error": str(exc)}, status_code=400)
+    spectrum = tile[0, 0]
+    return Response(
+        content=spectrum.astype("<f4", copy=False).tobytes(),
+        media_type="application/octet-stream",
+        headers={"X-Bands": str(spectrum.shape[0])},
+    )
+
+
+@app.get("/pixel/tile")
+def get_pixel_tile(x: int, y: int, radius: int = 4):
+    """Return the neighbourhood around a pixel as float32 (rows, cols, bands) bytes."""
+
+    if CUBE is None:
+        return JSONResponse({"error": "No cube loaded"}, status_code=400)
+    radius = max(0, min(int(radius), PROBE_MAX_RADIUS))
+    try:
+        tile, (x0, y0) = _probe_tile(x, y, radius)
+    except ValueError as exc:
+        return JSONResponse({"error": str(exc)}, status_code=400)
+    return Response(
+        content=tile.astype("<f4", copy=False).tobytes(),
+        media_type="application/octet-stream",
+        headers={
+            "X-Bands": str(tile.shape[2]),
+            "X-Tile-X0": str(x0),
+            "X-Tile-Y0": str(y0),
+            "X-Tile-Width": str(tile.shape[1]),
+            "X-Tile-Height": str(tile.shape[0]),
+        },
+    )
+
+
+@app.websocket("/ws/pixel")
+async def stream_pixel_spectra(websocket: WebSocket):
+    """Answer each ``"x,y"`` text message with that pixel's float32 spectrum.
+
+    Errors are reported as JSON text messages so the binary channel only
+    ever carries spectra.
+    """
+
+    await websocket.accept()
+    try:
+        while True:
+            message = await websocket.receive_text()
+            _sync_shared_dataset()
+            if CUBE is None:
+                await websocket.send_json({"error": "No cube loaded"})
+                continue
+            try:
+                x_text, y_text = message.split(",", 1)
+                tile, _ = _probe_tile(int(x_text), int(y_text), 0)
+            except ValueError as exc:
+                await websocket.send_json({"error": str(exc) or "Invalid coordinates"})
+                continue
+            await websocket.send_bytes(tile[0, 0].astype("<f4", copy=False).tobytes())
+    except WebSocketDisconnect:
+        return
 
 
 @app.post("/analysis")
 async def run_analysis(req: Request):
-    if CUBE is None:
+    dataset = _dataset_snapshot()
+    if dataset["cube"] is None:
         return JSONResponse({"error": "No cube loaded"}, status_code=400)
 
     try:
@@ -566,6 +1924,10 @@ async def run_analysis(req: Request):
         return JSONResponse({"error": "Invalid request payload"}, status_code=400)
 
     method = str(payload.get("method", "")).strip().lower()
+    try:
+        stages = _parse_pipeline(payload)
+    except ValueError as exc:
+        return JSONResponse({"error": str(exc)}, status_code=400)
 
     if method == "pca":
         components = payload.get("components", 3)
@@ -574,14 +1936,28 @@ async def run_analysis(req: Request):
         except (TypeError, ValueError):
             return JSONResponse({"error": "Invalid number of components"}, status_code=400)
         components = max(1, min(components, 10))
+
+        def compute_pca(chunked: bool) -> dict:
+            view = _get_pipeline_view(stages, dataset)
+            result = _compute_pca_components(
+                view["cube"], components, basis=_get_pca_basis(view), chunked=chunked
+            )
+            return {"method": "pca", "components": result}
+
         try:
-            result = _compute_pca_components(CUBE, components)
+            estimate = _admission_estimate(
+                "pca", stages, None, dataset, components=components
+            )
+            return await run_in_threadpool(_run_admitted, "pca", estimate, compute_pca)
+        except AdmissionError as exc:
+            return _admission_error_response(exc)
+        except ValueError as exc:
+            return JSONResponse({"error": str(exc)}, status_code=400)
         except Exception as exc:
             return JSONResponse(
                 {"error": f"Failed to compute PCA components: {exc}"},
                 status_code=500,
             )
-        return {"method": "pca", "components": result}
 
     if method == "kmeans":
         clusters = payload.get("clusters", 5)
@@ -591,13 +1967,32 @@ async def run_analysis(req: Request):
             return JSONResponse({"error": "Invalid cluster count"}, status_code=400)
         clusters = max(2, min(clusters, 20))
         try:
-            result = _compute_kmeans_segmentation(CUBE, clusters)
+            reduction = _parse_reduction(payload)
+        except ValueError as exc:
+            return JSONResponse({"error": str(exc)}, status_code=400)
+
+        def compute_kmeans(chunked: bool) -> dict:
+            view = _get_pipeline_view(stages, dataset)
+            reduced = _get_reduced_cube(*reduction, view=view) if reduction else None
+            result = _compute_kmeans_segmentation(
+                view["cube"], clusters, reduced=reduced, bands=view["bands"], chunked=chunked
+            )
+            return {"method": "kmeans", **result}
+
+        try:
+            estimate = _admission_estimate(
+                "kmeans", stages, reduction, dataset, clusters=clusters
+            )
+            return await run_in_threadpool(_run_admitted, "kmeans", estimate, compute_kmeans)
+        except AdmissionError as exc:
+            return _admission_error_response(exc)
+        except ValueError as exc:
+            return JSONResponse({"error": str(exc)}, status_code=400)
         except Exception as exc:
             return JSONResponse(
                 {"error": f"Failed to compute k-means clustering: {exc}"},
                 status_code=500,
             )
-        return {"method": "kmeans", **result}
 
     return JSONResponse(
         {"error": f"Unsupported analysis method: {method or 'unknown'}"},
@@ -605,9 +2000,113 @@ async def run_analysis(req: Request):
     )
 
 
+@app.post("/pipelines")
+async def register_pipeline(req: Request):
+    """Register a preprocessing chain and return the id analyses can refer to.
+
+    Stages run lazily on the first request that uses the pipeline; the id is
+    derived from the normalized stages, so registering the same chain twice
+    returns the same id.  Only the ``PIPELINE_REGISTRY_SIZE`` most recently
+    used ids are kept.
+    """
+
+    try:
+        payload = await req.json()
+    except Exception:
+        return JSONResponse({"error": "Invalid request payload"}, status_code=400)
+    try:
+        stages = normalize_pipeline(payload.get("stages") if isinstance(payload, dict) else None)
+    except ValueError as exc:
+        return JSONResponse({"error": str(exc)}, status_code=400)
+    pipeline_id = pipeline_key(stages)
+    with CACHE_LOCK:
+        _lru_writer(PIPELINES, pipeline_id, PIPELINE_REGISTRY_SIZE)(stages)
+    return {"id": pipeline_id, "stages": stages}
+
+
+@app.get("/pipelines")
+def list_pipelines():
+    with CACHE_LOCK:
+        registered = list(PIPELINES.items())
+    return {
+        "pipelines": [
+            {"id": pipeline_id, "stages": stages, "computed": pipeline_id in PIPELINE_VIEWS}
+            for pipeline_id, stages in registered
+        ]
+    }
+
+
+@app.get("/index/presets")
+def get_index_presets():
+    return {"presets": INDEX_PRESETS}
+
+
+@app.post("/index")
+async def compute_index(req: Request):
+    dataset = _dataset_snapshot()
+    cube = dataset["cube"]
+    if cube is None:
+        return JSONResponse({"error": "No cube loaded"}, status_code=400)
+
+    try:
+        payload = await req.json()
+    except Exception:
+        return JSONResponse({"error": "Invalid request payload"}, status_code=400)
+
+    preset = str(payload.get("preset") or "").strip().lower()
+    expression = payload.get("expression")
+    if preset:
+        expression = INDEX_PRESETS.get(preset)
+        if expression is None:
+            return JSONResponse(
+                {"error": f"Unknown index preset: {preset}"}, status_code=400
+            )
+    if not expression:
+        return JSONResponse(
+            {"error": "Provide an index expression or preset."}, status_code=400
+        )
+    if not isinstance(expression, str):
+        return JSONResponse(
+            {"error": "Index expression must be a string."}, status_code=400
+        )
+
+    wavelengths = dataset["bands"]
+    if wavelengths is None:
+        wavelengths = list(range(cube.shape[2]))
+
+    def compute(_chunked: bool) -> dict:
+        values, band_map = evaluate_index(cube, wavelengths, expression)
+        return {
+            "expression": expression,
+            "preset": preset or None,
+            "bands": {
+                name: {"index": index, "wavelength": float(wavelengths[index])}
+                for name, index in band_map.items()
+            },
+            "image": _encode_grayscale_image(values),
+            "stats": summarize_index(values),
+        }
+
+    try:
+        _, names = compile_expression(expression)
+        estimate = _admission_estimate(
+            "index", None, None, dataset, references=len(set(names))
+        )
+        return await run_in_threadpool(_run_admitted, "index", estimate, compute)
+    except AdmissionError as exc:
+        return _admission_error_response(exc)
+    except ValueError as exc:
+        return JSONResponse({"error": str(exc)}, status_code=400)
+    except Exception as exc:
+        return JSONResponse(
+            {"error": f"Failed to compute index: {exc}"}, status_code=500
+        )
+
+
 @app.post("/supervised")
 async def run_supervised(req: Request):
-    if CUBE is None:
+    dataset = _dataset_snapshot()
+    if dataset["cube"] is None:
         return JSONResponse({"error": "No cube loaded"}, status_code=400)
 
     try:
@@ -628,7 +2127,35 @@ async def run_supervised(req: Request):
         )
 
     try:
-        result = _classify_with_sam(CUBE, annotations)
+        reduction = _parse_reduction(payload)
+        stages = _parse_pipeline(payload)
+    except ValueError as exc:
+        return JSONResponse({"error": str(exc)}, status_code=400)
+
+    def compute_sam(chunked: bool) -> dict:
+        view = _get_pipeline_view(stages, dataset)
+        reduced = _get_reduced_cube(*reduction, view=view) if reduction else None
+        return _classify_with_sam(
+            view["cube"],
+            annotations,
+            reduced=reduced,
+            annotation_cache=view["annotation_cache"],
+            bands=view["bands"],
+            chunked=chunked,
+        )
+
+    try:
+        estimate = _admission_estimate(
+            "sam",
+            stages,
+            reduction,
+            dataset,
+            classes=_count_classes(annotations),
+            tile_rows=SAM_TILE_ROWS,
+        )
+        result = await run_in_threadpool(_run_admitted, "sam", estimate, compute_sam)
+    except AdmissionError as exc:
+        return _admission_error_response(exc)
     except ValueError as exc:
         return JSONResponse({"error": str(exc)}, status_code=400)
     except Exception as exc:
@@ -638,3 +2165,179 @@ async def run_supervised(req: Request):
         )
 
     return result
+
+
+def _iter_with_reduction(
+    iter_fn: Callable,
+    dataset: dict,
+    reduction: Optional[Tuple[str, int]],
+    stages: Optional[List[dict]],
+    *args,
+    use_annotation_cache: bool = False,
+    **kwargs,
+):
+    """Build the preprocessed view and reduced working cube on the first step.
+
+    This keeps the heavy preparation inside the worker thread.  The view's
+    cube is passed as the first positional argument of ``iter_fn``.
+    """
+
+    view = _get_pipeline_view(stages, dataset)
+    reduced = _get_reduced_cube(*reduction, view=view) if reduction else None
+    if use_annotation_cache:
+        kwargs["annotation_cache"] = view["annotation_cache"]
+    return (
+        yield from iter_fn(view["cube"], *args, reduced=reduced, bands=view["bands"], **kwargs)
+    )
+
+
+def _iter_admitted(operation: str, estimate: Dict[str, int], *args, **kwargs):
+    """Hold a memory admission for the whole stream; see ``_run_admitted``.
+
+    Admission (and any queueing) happens on the first step, inside the
+    worker thread, and is released when the stream finishes or is closed.
+    """
+
+    with MEMORY_BUDGET.admit(operation, estimate) as decision:
+        result = yield from _iter_with_reduction(
+            *args, chunked=decision["path"] == "chunked", **kwargs
+        )
+    if result is None:
+        return None
+    return {**result, "admission": decision}
+
+
+def _open_analysis_stream(payload: dict, should_stop: StopCheck) -> Generator:
+    """Build the streaming computation requested over the analysis websocket."""
+
+    if not isinstance(payload, dict):
+        raise ValueError("Invalid request payload")
+    method = str(payload.get("method", "")).strip().lower()
+    reduction = _parse_reduction(payload)
+    stages = _parse_pipeline(payload)
+    dataset = _dataset_snapshot()
+
+    if method == "kmeans":
+        clusters = payload.get("clusters", 5)
+        try:
+            clusters = int(clusters)
+        except (TypeError, ValueError) as exc:
+            raise ValueError("Invalid cluster count") from exc
+        clusters = max(2, min(clusters, 20))
+        estimate = _admission_estimate("kmeans", stages, reduction, dataset, clusters=clusters)
+        return _iter_admitted(
+            "kmeans",
+            estimate,
+            _iter_kmeans_segmentation,
+            dataset,
+            reduction,
+            stages,
+            clusters,
+            should_stop=should_stop,
+        )
+
+    if method in {"sam", "spectral-angle", "spectral_angle_mapper"}:
+        annotations = payload.get("annotations")
+        if not isinstance(annotations, list) or not annotations:
+            raise ValueError("Provide at least one annotated region.")
+        tile_rows = payload.get("tile_rows", SAM_TILE_ROWS)
+        try:
+            tile_rows = max(1, int(tile_rows))
+        except (TypeError, ValueError) as exc:
+            raise ValueError("Invalid tile size") from exc
+        estimate = _admission_estimate(
+            "sam",
+            stages,
+            reduction,
+            dataset,
+            classes=_count_classes(annotations),
+            tile_rows=tile_rows,
+        )
+        return _iter_admitted(
+            "sam",
+            estimate,
+            _iter_sam_classification,
+            dataset,
+            reduction,
+            stages,
+            annotations,
+            tile_rows=tile_rows,
+            should_stop=should_stop,
+            use_annotation_cache=True,
+        )
+
+    raise ValueError(f"Unsupported streaming method: {method or 'unknown'}")
+
+
+@app.websocket("/ws/analysis")
+async def stream_analysis(websocket: WebSocket):
+    """Stream intermediate k-means or SAM results to the client.
+
+    The client sends one JSON request (same fields as ``/analysis`` or
+    ``/supervised``) and may later send ``{"action": "stop"}``.  k-means then
+    finishes with the current centers; SAM ends with a ``stopped`` event.
+    """
+
+    await websocket.accept()
+    _sync_shared_dataset()
+    try:
+        payload = await websocket.receive_json()
+    except (WebSocketDisconnect, ValueError):
+        return
+
+    if CUBE is None:
+        await websocket.send_json({"type": "error", "error": "No cube loaded"})
+        await websocket.close()
+        return
+
+    stop_requested = asyncio.Event()
+
+    async def _listen_for_stop():
+        try:
+            while True:
+                message = await websocket.receive_json()
+                if isinstance(message, dict) and str(message.get("action", "")).lower() == "stop":
+                    stop_requested.set()
+        except (WebSocketDisconnect, ValueError, RuntimeError):
+            stop_requested.set()
+
+    try:
+        steps = _open_analysis_stream(payload, stop_requested.is_set)
+    except ValueError as exc:
+        await websocket.send_json({"type": "error", "error": str(exc)})
+        await websocket.close()
+        return
+
+    method = str(payload.get("method", "")).strip().lower()
+    listener = asyncio.create_task(_listen_for_stop())
+    try:
+        while True:
+            done, value = await run_in_threadpool(_advance, steps)
+            if not done:
+                await websocket.send_json(value)
+                continue
+            if value is None:
+                await websocket.send_json({"type": "stopped"})
+            else:
+                await websocket.send_json({"type": "result", "method": method, **value})
+            break
+        await websocket.close()
+    except (WebSocketDisconnect, RuntimeError):
+        # The client went away; nothing left to report.
+        pass
+    except AdmissionError as exc:
+        await websocket.send_json(
+            {"type": "error", "error": str(exc), "admission": exc.decision}
+        )
+        await websocket.close()
+    except ValueError as exc:
+        await websocket.send_json({"type": "error", "error": str(exc)})
+        await websocket.close()
+    except Exception as exc:
+        await websocket.send_json(
+            {"type": "error", "error": f"Streaming analysis failed: {exc}"}
+        )
+        await websocket.close()
+    finally:
+        listener.cancel()
+        steps.close()
@@ -0,0 +1,278 @@
+import contextlib
+import hashlib
+import json
+import math
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from hsi_loader import CHUNK_ELEMENTS
+
+PIPELINE_CACHE_SIZE = 8
+
+STAGE_OPS = ("remove_bands", "smooth", "derivative", "continuum_removal", "snv")
+
+
+def _odd_window(value, polyorder: int) -> int:
+    window = int(value)
+    if window < 3 or window % 2 == 0:
+        raise ValueError("Window length must be an odd integer of at least 3")
+    if polyorder >= window:
+        raise ValueError("Polynomial order must be smaller than the window length")
+    return window
+
+
+def normalize_stage(stage: dict) -> dict:
+    """Validate one stage definition and fill in its defaults."""
+
+    if not isinstance(stage, dict):
+        raise ValueError("Each pipeline stage must be an object")
+    op = str(stage.get("op", "")).strip().lower()
+    if op not in STAGE_OPS:
+        raise ValueError(f"Unsupported preprocessing stage: {op or 'unknown'}")
+
+    if op == "remove_bands":
+        try:
+            bands = sorted({int(b) for b in stage.get("bands") or []})
+            ranges = [
+                [float(low), float(high)] for low, high in stage.get("ranges") or []
+            ]
+        except (TypeError, ValueError) as exc:
+            raise ValueError("Invalid bad-band definition") from exc
+        if not bands and not ranges:
+            raise ValueError("remove_bands needs band indices or wavelength ranges")
+        return {"op": op, "bands": bands, "ranges": ranges}
+
+    if op in {"smooth", "derivative"}:
+        try:
+            polyorder = int(stage.get("polyorder", 2))
+            order = int(stage.get("order", 1)) if op == "derivative" else 0
+        except (TypeError, ValueError) as exc:
+            raise ValueError("Invalid filter settings") from exc
+        if polyorder < 0:
+            raise ValueError("Polynomial order must not be negative")
+        if op == "derivative" and not 1 <= order <= polyorder:
+            raise ValueError("Derivative order must be between 1 and the polynomial order")
+        window = _odd_window(stage.get("window", 7), polyorder)
+        normalized = {"op": op, "window": window, "polyorder": polyorder}
+        if op == "derivative":
+            normalized["order"] = order
+        return normalized
+
+    return {"op": op}
+
+
+def normalize_pipeline(stages) -> List[dict]:
+    if not isinstance(stages, list) or not stages:
+        raise ValueError("A pipeline needs at least one stage")
+    return [normalize_stage(stage) for stage in stages]
+
+
+def pipeline_key(stages: Sequence[dict]) -> str:
+    """Stable identifier for a normalized stage chain."""
+
+    text = json.dumps(list(stages), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _row_blocks(height: int, row_size: int):
+    rows = max(1, CHUNK_ELEMENTS // max(1, row_size))
+    for start in range(0, height, rows):
+        yield slice(start, min(height, start + rows))
+
+
+def _band_positions(wavelengths: Sequence[float]) -> np.ndarray:
+    """Band x-coordinates; falls back to indices when wavelengths are unusable."""
+
+    positions = np.asarray(wavelengths, dtype=np.float64)
+    if positions.size > 1 and np.all(np.diff(positions) > 0):
+        return positions
+    return np.arange(positions.size, dtype=np.float64)
+
+
+def savgol_coefficients(
+    window: int, polyorder: int, deriv: int = 0, delta: float = 1.0
+) -> np.ndarray:
+    """Savitzky-Golay convolution weights, ordered like the window samples."""
+
+    half = window // 2
+    offsets = np.arange(-half, half + 1, dtype=np.float64)
+    design = np.vander(offsets, polyorder + 1, increasing=True)
+    weights = np.linalg.pinv(design)[deriv]
+    return weights * math.factorial(deriv) / (delta ** deriv)
+
+
+def _remove_bands(cube, wavelengths, stage):
+    band_count = cube.shape[2]
+    keep = np.ones(band_count, dtype=bool)
+    for index in stage["bands"]:
+        if 0 <= index < band_count:
+            keep[index] = False
+    positions = np.asarray(wavelengths, dtype=np.float64)
+    for low, high in stage["ranges"]:
+        keep &= ~((positions >= min(low, high)) & (positions <= max(low, high)))
+    if not np.any(keep):
+        raise ValueError("Bad-band removal would drop every band")
+    indices = np.flatnonzero(keep)
+    out = np.empty(cube.shape[:2] + (indices.size,), dtype=np.float32)
+    for rows in _row_blocks(cube.shape[0], cube.shape[1] * band_count):
+        out[rows] = np.take(cube[rows], indices, axis=2)
+    return out, [wavelengths[i] for i in indices]
+
+
+def _savgol(cube, wavelengths, stage):
+    band_count = cube.shape[2]
+    window = stage["window"]
+    if window > band_count:
+        raise ValueError("Filter window is longer than the number of bands")
+    deriv = stage.get("order", 0)
+    positions = _band_positions(wavelengths)
+    delta = float(np.mean(np.diff(positions))) if positions.size > 1 else 1.0
+    weights = savgol_coefficients(window, stage["polyorder"], deriv, delta).astype(np.float32)
+    half = window // 2
+    out = np.empty(cube.shape, dtype=np.float32)
+    for rows in _row_blocks(cube.shape[0], cube.shape[1] * band_count):
+        padded = np.pad(
+            cube[rows].astype(np.float32), ((0, 0), (0, 0), (half, half)), mode="edge"
+        )
+        block = np.zeros(padded.shape[:2] + (band_count,), dtype=np.float32)
+        for tap, weight in enumerate(weights):
+            block += weight * padded[:, :, tap : tap + band_count]
+        out[rows] = block
+    return out, list(wavelengths)
+
+
+def _upper_hull_continuum(spectra: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """Evaluate each spectrum's upper convex hull at every band.
+
+    A monotone-chain hull is built for all spectra at once: every pixel keeps
+    its own vertex stack and the pop loop runs while any pixel still pops.
+    """
+
+    count, band_count = spectra.shape
+    if band_count < 3:
+        return spectra.copy()
+    rows = np.arange(count)
+    stack = np.zeros((count, band_count), dtype=np.int64)
+    top = np.zeros(count, dtype=np.int64)
+
+    for band in range(band_count):
+        while True:
+            candidates = np.flatnonzero(top >= 2)
+            if candidates.size == 0:
+                break
+            origin = stack[candidates, top[candidates] - 2]
+            middle = stack[candidates, top[candidates] - 1]
+            cross = (positions[middle] - positions[origin]) * (
+                spectra[candidates, band] - spectra[candidates, origin]
+            ) - (spectra[candidates, middle] - spectra[candidates, origin]) * (
+                positions[band] - positions[origin]
+            )
+            popping = candidates[cross >= 0]
+            if popping.size == 0:
+                break
+            top[popping] -= 1
+        stack[rows, top] = band
+        top += 1
+
+    # Walk each pixel's hull segments left to right and interpolate.
+    continuum = np.empty_like(spectra)
+    segment = np.zeros(count, dtype=np.int64)
+    last = band_count - 1
+    for band in range(band_count):
+        while True:
+            advance = (segment + 2 < top) & (stack[rows, np.minimum(segment + 1, last)] <= band)
+            if not np.any(advance):
+                break
+            segment[advance] += 1
+        left = stack[rows, segment]
+        right = stack[rows, np.minimum(segment + 1, last)]
+        span = positions[right] - positions[left]
+        safe_span = np.where(span > 0, span, 1.0)
+        fraction = np.where(span > 0, (positions[band] - positions[left]) / safe_span, 0.0)
+        left_values = spectra[rows, left]
+        continuum[:, band] = left_values + fraction * (spectra[rows, right] - left_values)
+    return continuum
+
+
+def _continuum_removal(cube, wavelengths, stage):
+    height, width, band_count = cube.shape
+    positions = _band_positions(wavelengths)
+    out = np.empty(cube.shape, dtype=np.float32)
+    for rows in _row_blocks(height, width * band_count):
+        spectra = np.nan_to_num(cube[rows].reshape(-1, band_count).astype(np.float64))
+        continuum = _upper_hull_continuum(spectra, positions)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(continuum > 0, spectra / continuum, 0.0)
+        out[rows] = ratio.reshape(-1, width, band_count)
+    return out, list(wavelengths)
+
+
+def _snv(cube, wavelengths, stage):
+    height, width, band_count = cube.shape
+    out = np.empty(cube.shape, dtype=np.float32)
+    for rows in _row_blocks(height, width * band_count):
+        block = cube[rows].astype(np.float32)
+        mean = block.mean(axis=2, keepdims=True)
+        std = block.std(axis=2, keepdims=True)
+        block -= mean
+        np.divide(block, std, out=block, where=std > 1e-12)
+        block[np.broadcast_to(std <= 1e-12, block.shape)] = 0.0
+        out[rows] = block
+    return out, list(wavelengths)
+
+
+_STAGE_FUNCTIONS = {
+    "remove_bands": _remove_bands,
+    "smooth": _savgol,
+    "derivative": _savgol,
+    "continuum_removal": _continuum_removal,
+    "snv": _snv,
+}
+
+
+def run_pipeline(
+    cube: np.ndarray,
+    wavelengths: Sequence[float],
+    stages: Sequence[dict],
+    cache: Optional["OrderedDict[str, Tuple[np.ndarray, List[float]]]"] = None,
+    cache_size: int = PIPELINE_CACHE_SIZE,
+    lock=None,
+) -> Tuple[np.ndarray, List[float]]:
+    """Apply normalized ``stages`` to ``cube``, reusing memoized prefixes.
+
+    Every intermediate result is stored in ``cache`` under the key of the
+    stage chain that produced it, so pipelines sharing a prefix only compute
+    the stages after it.  The cache is trimmed to ``cache_size`` entries,
+    least recently used first.  When other threads touch ``cache``, pass the
+    ``lock`` they use; it is only held for each lookup and insert, never
+    while a stage runs.
+    """
+
+    guard = lock if lock is not None else contextlib.nullcontext()
+    current, current_bands = cube, list(wavelengths)
+    start = 0
+    if cache is not None:
+        for end in range(len(stages), 0, -1):
+            key = pipeline_key(stages[:end])
+            with guard:
+                memo = cache.get(key)
+                if memo is not None:
+                    cache.move_to_end(key)
+            if memo is not None:
+                current, current_bands = memo
+                start = end
+                break
+
+    for end in range(start + 1, len(stages) + 1):
+        stage = stages[end - 1]
+        stage_function = _STAGE_FUNCTIONS[stage["op"]]
+        current, current_bands = stage_function(current, current_bands, stage)
+        if cache is not None:
+            with guard:
+                cache[pipeline_key(stages[:end])] = (current, current_bands)
+                while len(cache) > cache_size:
+                    cache.popitem(last=False)
+
+    return current, current_bands
@@ -0,0 +1,143 @@
+import functools
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Directory holding shared cubes and the registry; unset disables sharing.
+SHARED_DIR_ENV = "HSI_SHARED_DIR"
+REGISTRY_NAME = "registry.json"
+# Generations kept on disk so workers still attaching to the previous cube
+# do not lose it underneath them.
+KEEP_GENERATIONS = 2
+
+
+@functools.lru_cache(maxsize=None)
+def _prepare_dir(value: str) -> Path:
+    path = Path(value)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def shared_dir() -> Optional[Path]:
+    """Return the shared dataset directory, or ``None`` when sharing is off.
+
+    Called on every request, so the directory is only created the first
+    time a given path is seen.
+    """
+
+    value = os.environ.get(SHARED_DIR_ENV, "").strip()
+    if not value:
+        return None
+    return _prepare_dir(value)
+
+
+def registry_mtime(folder: Path) -> Optional[int]:
+    """Cheap change check so workers only re-read the registry after a load."""
+
+    try:
+        return (folder / REGISTRY_NAME).stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def read_registry(folder: Path) -> Optional[dict]:
+    try:
+        with open(folder / REGISTRY_NAME, "r", encoding="utf-8") as handle:
+            return json.load(handle)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_registry(folder: Path, entry: dict) -> None:
+    # Write then rename so readers never observe a partial file.
+    temp_path = folder / f".{REGISTRY_NAME}.{uuid.uuid4().hex}"
+    with open(temp_path, "w", encoding="utf-8") as handle:
+        json.dump(entry, handle)
+    os.replace(temp_path, folder / REGISTRY_NAME)
+
+
+def _remove_stale(folder: Path, keep: List[str]) -> None:
+    for path in folder.glob("*.npy"):
+        generation = path.name.split(".", 1)[0]
+        if generation in keep:
+            continue
+        try:
+            path.unlink()
+        except OSError:
+            # Still mapped by a worker on platforms that forbid unlinking.
+            pass
+    for path in folder.glob("*.stats.npz"):
+        if path.name.split(".", 1)[0] not in keep:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+def publish_dataset(
+    folder: Path,
+    cube: np.ndarray,
+    bands: List[float],
+    warning: Optional[str] = None,
+    stats: Optional[dict] = None,
+    source: Optional[str] = None,
+) -> Tuple[str, np.ndarray]:
+    """Write ``cube`` to a shared memmap and register it as the current dataset.
+
+    Returns the new generation id and a read-only memmap of the written cube,
+    which the caller should use in place of its private copy.  ``source``
+    records the folder a full, unwindowed load came from, so other workers
+    can tell they would load the same data.
+    """
+
+    generation = uuid.uuid4().hex
+    cube_path = folder / f"{generation}.cube.npy"
+    target = np.lib.format.open_memmap(
+        cube_path, mode="w+", dtype=np.float32, shape=cube.shape
+    )
+    target[...] = cube
+    target.flush()
+    del target
+
+    if stats is not None:
+        np.savez(folder / f"{generation}.stats.npz", **stats)
+
+    previous = read_registry(folder)
+    retained = [generation]
+    if previous:
+        older = previous.get("retained") or [previous.get("generation")]
+        retained += older[: KEEP_GENERATIONS - 1]
+    entry = {
+        "generation": generation,
+        "cube": cube_path.name,
+        "shape": list(cube.shape),
+        "bands": list(bands) if bands is not None else None,
+        "warning": warning,
+        "stats": stats is not None,
+        "source": source,
+        "previous": previous.get("generation") if previous else None,
+        "retained": retained,
+    }
+    _write_registry(folder, entry)
+    _remove_stale(folder, retained)
+
+    return generation, np.load(cube_path, mmap_mode="r")
+
+
+def attach_dataset(folder: Path, entry: dict):
+    """Map a registered dataset without copying it.
+
+    Returns ``(cube, bands, warning, stats)``; ``stats`` is ``None`` when the
+    publishing worker did not store them.
+    """
+
+    cube = np.load(folder / entry["cube"], mmap_mode="r")
+    stats = None
+    if entry.get("stats"):
+        with np.load(folder / f"{entry['generation']}.stats.npz") as archive:
+            stats = {key: archive[key] for key in archive.files}
+    return cube, entry.get("bands"), entry.get("warning"), stats
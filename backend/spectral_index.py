@@ -0,0 +1,190 @@
+import ast
+import functools
+import re
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from hsi_loader import CHUNK_ELEMENTS
+
+# Named presets; band references use the same syntax as user expressions.
+INDEX_PRESETS: Dict[str, str] = {
+    "ndvi": "(R800 - R670) / (R800 + R670)",
+    "gndvi": "(R800 - R550) / (R800 + R550)",
+    "ndre": "(R790 - R720) / (R790 + R720)",
+    "pri": "(R531 - R570) / (R531 + R570)",
+    "sipi": "(R800 - R445) / (R800 - R680)",
+    "ndwi": "(R860 - R1240) / (R860 + R1240)",
+    "msi": "R1600 / R820",
+}
+
+# ``R<wavelength>`` picks the band nearest to a wavelength, ``B<index>`` a band
+# by position.
+_BAND_NAME = re.compile(r"^(?P<kind>[RB])(?P<value>\d+(?:_\d+)?)$")
+
+_BINARY_OPS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.Pow: np.power,
+}
+
+_UNARY_OPS = {
+    ast.USub: np.negative,
+    ast.UAdd: np.positive,
+}
+
+_FUNCTIONS = {
+    "abs": np.abs,
+    "sqrt": np.sqrt,
+    "log": np.log,
+    "log10": np.log10,
+    "exp": np.exp,
+    "min": np.minimum,
+    "max": np.maximum,
+}
+
+Evaluator = Callable[[Dict[str, np.ndarray]], np.ndarray]
+
+
+def _compile_node(node: ast.AST, names: List[str]) -> Evaluator:
+    """Turn a validated AST node into a closure over a band dictionary."""
+
+    if isinstance(node, ast.Expression):
+        return _compile_node(node.body, names)
+
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        value = np.float32(node.value)
+        return lambda _bands: value
+
+    if isinstance(node, ast.Name):
+        if not _BAND_NAME.match(node.id):
+            raise ValueError(f"Unknown band reference: {node.id}")
+        if node.id not in names:
+            names.append(node.id)
+        name = node.id
+        return lambda bands: bands[name]
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+        op = _BINARY_OPS[type(node.op)]
+        left = _compile_node(node.left, names)
+        right = _compile_node(node.right, names)
+        return lambda bands: op(left(bands), right(bands))
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        op = _UNARY_OPS[type(node.op)]
+        operand = _compile_node(node.operand, names)
+        return lambda bands: op(operand(bands))
+
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+        func = _FUNCTIONS.get(node.func.id)
+        if func is None:
+            raise ValueError(f"Unsupported function: {node.func.id}")
+        args = [_compile_node(arg, names) for arg in node.args]
+        if func in (np.minimum, np.maximum):
+            if len(args) != 2:
+                raise ValueError(f"{node.func.id}() takes exactly two arguments")
+        elif len(args) != 1:
+            raise ValueError(f"{node.func.id}() takes exactly one argument")
+        return lambda bands: func(*(arg(bands) for arg in args))
+
+    raise ValueError("Unsupported syntax in index expression")
+
+
+@functools.lru_cache(maxsize=128)
+def compile_expression(expression: str) -> Tuple[Evaluator, Tuple[str, ...]]:
+    """Parse a band-math expression once and return ``(evaluator, band_names)``.
+
+    Only arithmetic, numeric constants, band references and the functions in
+    ``_FUNCTIONS`` are accepted, so user input never reaches ``eval``.
+    """
+
+    text = str(expression or "").strip()
+    if not text:
+        raise ValueError("Index expression is empty")
+    try:
+        tree = ast.parse(text, mode="eval")
+    except SyntaxError as exc:
+        raise ValueError(f"Invalid index expression: {exc.msg}") from exc
+
+    names: List[str] = []
+    evaluator = _compile_node(tree, names)
+    if not names:
+        raise ValueError("Index expression must reference at least one band")
+    return evaluator, tuple(names)
+
+
+def resolve_band_references(
+    names: Sequence[str], wavelengths: Sequence[float]
+) -> Dict[str, int]:
+    """Map each band reference to a band index of the loaded cube.
+
+    Wavelength references snap to the nearest band but must fall within the
+    sampled range (padded by one band spacing).
+    """
+
+    centers = np.asarray(wavelengths, dtype=np.float64)
+    if centers.size == 0:
+        raise ValueError("Dataset has no bands")
+    spacing = float(np.max(np.abs(np.diff(centers)))) if centers.size > 1 else 0.0
+    resolved: Dict[str, int] = {}
+
+    for name in names:
+        match = _BAND_NAME.match(name)
+        kind = match.group("kind")
+        value = float(match.group("value").replace("_", "."))
+        if kind == "B":
+            index = int(value)
+            if index < 0 or index >= centers.size:
+                raise ValueError(f"Band index out of range: {name}")
+        else:
+            if value < centers.min() - spacing or value > centers.max() + spacing:
+                raise ValueError(f"No band near {value:g} nm for {name}")
+            index = int(np.argmin(np.abs(centers - value)))
+        resolved[name] = index
+    return resolved
+
+
+def evaluate_index(
+    cube: np.ndarray,
+    wavelengths: Sequence[float],
+    expression: str,
+    chunk_elements: int = CHUNK_ELEMENTS,
+) -> Tuple[np.ndarray, Dict[str, int]]:
+    """Evaluate ``expression`` over ``cube`` one block of rows at a time.
+
+    Only the referenced bands are read from each block.  Returns the float32
+    index image and the band index used for every reference.
+    """
+
+    evaluator, names = compile_expression(expression)
+    band_map = resolve_band_references(names, wavelengths)
+    height, width = cube.shape[:2]
+    result = np.empty((height, width), dtype=np.float32)
+    rows = max(1, int(chunk_elements) // max(1, width * len(band_map)))
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        for start in range(0, height, rows):
+            block = cube[start : start + rows]
+            bands = {
+                name: np.asarray(block[:, :, index], dtype=np.float32)
+                for name, index in band_map.items()
+            }
+            result[start : start + rows] = evaluator(bands)
+    return result, band_map
+
+
+def summarize_index(values: np.ndarray) -> Dict[str, Optional[float]]:
+    """Return min/max/mean/std over the finite values of an index image."""
+
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return {"min": None, "max": None, "mean": None, "std": None, "valid_pixels": 0}
+    return {
+        "min": float(finite.min()),
+        "max": float(finite.max()),
+        "mean": float(finite.mean(dtype=np.float64)),
+        "std": float(finite.std(dtype=np.float64)),
+        "valid_pixels": int(finite.size),
+    }
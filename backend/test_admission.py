@@ -0,0 +1,269 @@
+import numpy as np
+import sys
+import threading
+import time
+import types
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+mock_cv2 = types.ModuleType("cv2")
+
+
+def _imencode_stub(*_args, **_kwargs):
+    return True, np.array([], dtype=np.uint8)
+
+
+mock_cv2.imencode = _imencode_stub
+mock_cv2.cvtColor = lambda image, _code: image
+mock_cv2.COLOR_RGB2BGR = 4
+sys.modules.setdefault("cv2", mock_cv2)
+
+
+from main import app
+import main
+import admission
+from admission import AdmissionError, MemoryBudget
+
+
+client = TestClient(app)
+
+ANNOTATIONS = [
+    {"label": "a", "rect": {"x0": 0, "y0": 0, "x1": 4, "y1": 3}},
+    {"label": "b", "rect": {"x0": 0, "y0": 7, "x1": 4, "y1": 10}},
+]
+
+
+def setup_module(_module):
+    rng = np.random.default_rng(3)
+    cube = np.empty((10, 6, 12), dtype=np.float32)
+    cube[:5] = np.linspace(0.2, 0.9, 12)
+    cube[5:] = np.linspace(0.9, 0.2, 12)
+    cube += rng.normal(scale=0.02, size=cube.shape).astype(np.float32)
+    main.CUBE = cube
+    main.BANDS = list(range(12))
+    main._reset_dataset_caches()
+
+
+def teardown_module(_module):
+    main.CUBE = None
+    main.BANDS = None
+    main._reset_dataset_caches()
+
+
+def test_budget_prefers_memory_then_chunked_then_rejects():
+    budget = MemoryBudget(1000, timeout=0.0)
+    with budget.admit("kmeans", {"memory": 600, "chunked": 100}) as first:
+        assert first["path"] == "memory"
+        with budget.admit("sam", {"memory": 600, "chunked": 300}) as second:
+            assert second["path"] == "chunked"
+            assert budget.snapshot()["in_use_bytes"] == 900
+            with pytest.raises(AdmissionError) as busy:
+                with budget.admit("pca", {"memory": 600, "chunked": 300}):
+                    pass
+            assert busy.value.status_code == 503
+    assert budget.snapshot()["in_use_bytes"] == 0
+
+    with pytest.raises(AdmissionError) as too_large:
+        with budget.admit("kmeans", {"memory": 5000, "chunked": 2000}):
+            pass
+    assert too_large.value.status_code == 413
+    assert too_large.value.decision["path"] == "rejected"
+
+
+def test_waiting_request_is_admitted_after_release():
+    budget = MemoryBudget(1000, timeout=5.0)
+    decisions = []
+    release = threading.Event()
+
+    def hold():
+        with budget.admit("kmeans", {"memory": 800, "chunked": 800}):
+            release.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    while budget.snapshot()["running"] == 0:
+        time.sleep(0.01)
+
+    def wait_for_budget():
+        with budget.admit("sam", {"memory": 500, "chunked": 500}) as decision:
+            decisions.append(decision)
+
+    waiter = threading.Thread(target=wait_for_budget)
+    waiter.start()
+    while budget.snapshot()["waiting"] == 0:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    release.set()
+    holder.join()
+    waiter.join()
+    assert decisions[0]["path"] == "memory"
+    assert decisions[0]["queued_seconds"] > 0
+
+
+def test_chunked_paths_match_in_memory_results():
+    kmeans = main._compute_kmeans_segmentation(main.CUBE, 2)
+    kmeans_chunked = main._compute_kmeans_segmentation(main.CUBE, 2, chunked=True)
+    assert [s["count"] for s in kmeans["cluster_summaries"]] == [
+        s["count"] for s in kmeans_chunked["cluster_summaries"]
+    ]
+
+    sam = main._classify_with_sam(main.CUBE, ANNOTATIONS)
+    sam_chunked = main._classify_with_sam(main.CUBE, ANNOTATIONS, chunked=True)
+    for full, chunked in zip(sam["classes"], sam_chunked["classes"]):
+        assert full["classified"]["pixels"] == chunked["classified"]["pixels"]
+        assert np.allclose(full["classified"]["spectra"], chunked["classified"]["spectra"], atol=1e-5)
+        assert np.allclose(full["classified"]["std"], chunked["classified"]["std"], atol=1e-4)
+
+    basis = main._compute_pca_basis(main.CUBE)
+    pca = main._compute_pca_components(main.CUBE, 2, basis=basis)
+    pca_chunked = main._compute_pca_components(main.CUBE, 2, basis=basis, chunked=True)
+    assert [c["variance"] for c in pca] == [c["variance"] for c in pca_chunked]
+
+
+def test_endpoints_report_the_chosen_path(monkeypatch):
+    # Only the chunked path fits, so it must be chosen and still succeed.
+    estimate = {"memory": 10_000, "chunked": 1_000}
+    monkeypatch.setattr(main, "_admission_estimate", lambda *_args, **_kwargs: estimate)
+    monkeypatch.setattr(main, "MEMORY_BUDGET", MemoryBudget(5_000, timeout=0.0))
+
+    res = client.post("/analysis", json={"method": "kmeans", "clusters": 2})
+    assert res.status_code == 200
+    admission = res.json()["admission"]
+    assert admission["path"] == "chunked"
+    assert admission["estimated_bytes"] == estimate
+
+    res = client.post("/supervised", json={"annotations": ANNOTATIONS})
+    assert res.status_code == 200
+    assert res.json()["admission"]["path"] == "chunked"
+    assert res.json()["classes"][0]["classified"]["pixels"] == 30
+    assert main.MEMORY_BUDGET.snapshot()["in_use_bytes"] == 0
+
+
+def test_estimates_grow_with_the_request():
+    small = main._admission_estimate("kmeans", None, None, clusters=2)
+    large = main._admission_estimate("kmeans", None, None, clusters=20)
+    assert large["memory"] > small["memory"]
+    assert small["chunked"] <= small["memory"]
+    stages = [{"op": "snv"}]
+    raw = main._admission_estimate("pca", None, None, components=3)
+    preprocessed = main._admission_estimate("pca", stages, None, components=3)
+    assert preprocessed["memory"] - raw["memory"] >= main.CUBE.nbytes
+
+
+def test_oversized_requests_are_rejected_with_a_clear_error(monkeypatch):
+    monkeypatch.setattr(main, "MEMORY_BUDGET", MemoryBudget(64, timeout=0.0))
+
+    res = client.post("/analysis", json={"method": "pca", "components": 3})
+    assert res.status_code == 413
+    assert "memory budget" in res.json()["error"]
+    assert res.json()["admission"]["path"] == "rejected"
+
+    with client.websocket_connect("/ws/analysis") as ws:
+        ws.send_json({"method": "kmeans", "clusters": 2})
+        event = ws.receive_json()
+    assert event["type"] == "error"
+    assert event["admission"]["operation"] == "kmeans"
+    assert main.MEMORY_BUDGET.snapshot()["in_use_bytes"] == 0
+
+
+def test_cached_bytes_count_against_the_budget_and_are_reclaimed():
+    held = [700]
+
+    def reclaim(_needed):
+        freed, held[0] = held[0], 0
+        return freed
+
+    budget = MemoryBudget(1000, timeout=0.0, resident=lambda: held[0], reclaim=reclaim)
+    with budget.admit("kmeans", {"memory": 200, "chunked": 100}) as decision:
+        assert decision["path"] == "memory"
+        assert budget.snapshot()["cached_bytes"] == 700
+    assert held == [700]
+
+    with budget.admit("kmeans", {"memory": 600, "chunked": 500}) as decision:
+        assert decision["path"] == "memory"
+    assert held == [0]
+
+
+def test_cached_views_are_measured_and_evicted():
+    main._reset_dataset_caches()
+    view = main._get_pipeline_view(main.normalize_pipeline([{"op": "snv"}]))
+    assert main._cached_bytes() >= view["cube"].nbytes
+    assert main._evict_cached(1) >= view["cube"].nbytes
+    assert not main.PIPELINE_VIEWS and not main.PIPELINE_CACHE
+
+
+def test_index_and_pipeline_spectra_are_admitted(monkeypatch):
+    spectra = {"rect": {"x0": 0, "y0": 0, "x1": 2, "y1": 2}, "pipeline": [{"op": "snv"}]}
+    res = client.post("/index", json={"expression": "B1 - B0"})
+    assert res.status_code == 200
+    assert res.json()["admission"]["operation"] == "index"
+    res = client.post("/spectra", json=spectra)
+    assert res.status_code == 200
+    assert res.json()["admission"]["operation"] == "spectra"
+
+    monkeypatch.setattr(main, "MEMORY_BUDGET", MemoryBudget(64, timeout=0.0))
+    main._reset_dataset_caches()
+    assert client.post("/index", json={"expression": "B1 - B0"}).status_code == 413
+    assert client.post("/spectra", json=spectra).status_code == 413
+
+
+def test_eviction_runs_safely_alongside_pipeline_builds():
+    main._reset_dataset_caches()
+    chains = [
+        main.normalize_pipeline([{"op": "snv"}] + [{"op": "smooth", "window": w, "polyorder": 1}])
+        for w in (3, 5, 7)
+    ]
+    errors = []
+    done = threading.Event()
+
+    def build():
+        try:
+            for _ in range(200):
+                for stages in chains:
+                    main._get_pipeline_view(stages)
+                    main.run_pipeline(
+                        main.CUBE, main.BANDS, stages, main.PIPELINE_CACHE, lock=main.CACHE_LOCK
+                    )
+        except Exception as exc:  # pragma: no cover - reported below
+            errors.append(exc)
+
+    def evict():
+        try:
+            while not done.is_set():
+                main._evict_cached(1 << 40)
+                main._cached_bytes()
+        except Exception as exc:  # pragma: no cover - reported below
+            errors.append(exc)
+
+    builders = [threading.Thread(target=build) for _ in range(2)]
+    evictors = [threading.Thread(target=evict) for _ in range(2)]
+    # Switch threads as often as possible so the race shows up reliably.
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in builders + evictors:
+            thread.start()
+        for thread in builders:
+            thread.join()
+        done.set()
+        for thread in evictors:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == []
+
+
+def test_default_budget_is_split_across_workers(monkeypatch):
+    monkeypatch.delenv(admission.MEMORY_BUDGET_ENV, raising=False)
+    monkeypatch.delenv(admission.SHARED_DIR_ENV, raising=False)
+    monkeypatch.delenv(admission.WORKERS_ENV, raising=False)
+    monkeypatch.setattr(admission, "_physical_memory", lambda: 8 << 30)
+    assert admission.configured_budget() == 4 << 30
+
+    monkeypatch.setenv(admission.WORKERS_ENV, "4")
+    assert admission.configured_budget() == 1 << 30
+
+    monkeypatch.setenv(admission.MEMORY_BUDGET_ENV, "256")
+    assert admission.configured_budget() == 256 << 20
@@ -0,0 +1,95 @@
+import numpy as np
+import sys
+import types
+from fastapi.testclient import TestClient
+
+
+mock_cv2 = types.ModuleType("cv2")
+
+
+def _imencode_stub(*_args, **_kwargs):
+    return True, np.array([], dtype=np.uint8)
+
+
+mock_cv2.imencode = _imencode_stub
+mock_cv2.cvtColor = lambda image, _code: image
+mock_cv2.COLOR_RGB2BGR = 4
+sys.modules.setdefault("cv2", mock_cv2)
+
+
+from main import app
+import main
+
+
+def setup_module(_module):
+    rng = np.random.default_rng(1)
+    cube = rng.uniform(0.1, 1.0, size=(6, 6, 4)).astype(np.float32)
+    main.CUBE = cube
+    main.BANDS = [500, 600, 700, 800]
+    main._reset_dataset_caches()
+
+
+def teardown_module(_module):
+    main.CUBE = None
+    main.BANDS = None
+    main._reset_dataset_caches()
+
+
+client = TestClient(app)
+
+ANNOTATIONS = [
+    {"label": "a", "rect": {"x0": 0, "y0": 0, "x1": 2, "y1": 2}},
+    {"label": "a", "rect": {"x0": 2, "y0": 0, "x1": 4, "y1": 1}},
+    {"label": "b", "rect": {"x0": 3, "y0": 3, "x1": 6, "y1": 6}},
+]
+
+
+def test_only_new_annotations_are_extracted(monkeypatch):
+    calls = []
+    original = main._annotation_statistics
+
+    def _counting(cube, annotation):
+        calls.append(annotation)
+        return original(cube, annotation)
+
+    monkeypatch.setattr(main, "_annotation_statistics", _counting)
+
+    first = client.post("/supervised", json={"annotations": ANNOTATIONS[:2] + ANNOTATIONS[2:]})
+    assert first.status_code == 200
+    assert len(calls) == 3
+
+    added = {"label": "b", "shape": {"type": "point", "x": 5, "y": 0}, "color": "#00ff00"}
+    relabeled = dict(ANNOTATIONS[0], label="c")
+    second = client.post("/supervised", json={"annotations": [relabeled] + ANNOTATIONS[1:] + [added]})
+    assert second.status_code == 200
+    assert len(calls) == 4
+    assert second.json()["training_cache"] == {"reused": 3, "extracted": 1}
+
+
+def test_incremental_statistics_match_direct_computation():
+    result = main._classify_with_sam(main.CUBE, ANNOTATIONS, annotation_cache={})
+    cube = main.CUBE
+    pixels = np.concatenate([cube[0:2, 0:2].reshape(-1, 4), cube[0:1, 2:4].reshape(-1, 4)])
+    training = {c["label"]: c["training"] for c in result["classes"]}
+    assert training["a"]["pixels"] == 6
+    assert np.allclose(training["a"]["spectra"], pixels.mean(axis=0), atol=1e-6)
+    assert np.allclose(training["a"]["std"], pixels.std(axis=0), atol=1e-5)
+
+
+def test_requests_from_a_replaced_dataset_do_not_fill_its_caches():
+    original = main.CUBE
+    steps = main._open_analysis_stream({"method": "sam", "annotations": ANNOTATIONS}, None)
+    replacement = original[::-1].copy()
+    main.CUBE = replacement
+    main._reset_dataset_caches()
+    try:
+        stale = main._run_to_completion(steps)
+        fresh = client.post("/supervised", json={"annotations": ANNOTATIONS}).json()
+        assert fresh["training_cache"] == {"reused": 0, "extracted": 3}
+        for result, cube in ((stale, original), (fresh, replacement)):
+            pixels = cube[3:6, 3:6].reshape(-1, 4)
+            training = {c["label"]: c["training"] for c in result["classes"]}
+            assert np.allclose(training["b"]["spectra"], pixels.mean(axis=0), atol=1e-6)
+    finally:
+        main.CUBE = original
+        main._reset_dataset_caches()
@@ -1,4 +1,6 @@
 import numpy as np
+import pytest
+from spectral.io import envi
 
 import hsi_loader
 
@@ -70,3 +72,100 @@ def test_preserves_calibrated_path(monkeypatch, tmp_path):
     assert np.allclose(corrected, expected)
     assert wavelengths == [10.0, 20.0]
     assert warning is None
+
+
+def test_percentile_stretch_ignores_hot_pixel():
+    rng = np.random.default_rng(0)
+    data = rng.uniform(0.0, 1.0, size=(40, 30, 2)).astype(np.float32)
+    data[0, 0, 0] = 1e6
+
+    low, high = hsi_loader.compute_stretch_bounds(data, mode="percentile", percentiles=(1.0, 99.0))
+
+    expected = np.percentile(data, [1.0, 99.0])
+    assert np.allclose(low, expected[0], atol=1e-2)
+    assert np.allclose(high, expected[1], atol=1e-2)
+
+
+def test_band_minmax_stretch_rescales_each_band_in_place():
+    data = np.stack(
+        [np.linspace(0.0, 10.0, 12), np.linspace(100.0, 200.0, 12)], axis=-1
+    ).reshape(3, 4, 2).astype(np.float32)
+    data[1, 1, 0] = np.nan
+
+    result = hsi_loader._normalize_uncalibrated_data(data, mode="band-minmax", inplace=True)
+
+    assert result is data
+    assert np.allclose(np.nanmin(result, axis=(0, 1)), 0.0)
+    assert np.allclose(np.nanmax(result, axis=(0, 1)), 1.0)
+
+
+def test_window_and_band_selection_restrict_loaded_cube(monkeypatch, tmp_path):
+    data = np.arange(6 * 5 * 4, dtype=np.float32).reshape(6, 5, 4)
+    dark = np.zeros((3, 5, 4), dtype=np.float32)
+    white = np.full((3, 5, 4), 1000.0, dtype=np.float32)
+
+    data_hdr = tmp_path / "scene.hdr"
+    dark_hdr = tmp_path / "darkref.hdr"
+    white_hdr = tmp_path / "whiteref.hdr"
+    for hdr in (data_hdr, dark_hdr, white_hdr):
+        hdr.touch()
+
+    monkeypatch.setattr(hsi_loader, "_iter_hdr_files", lambda _folder: iter([data_hdr, dark_hdr, white_hdr]))
+    monkeypatch.setattr(hsi_loader, "find_file", lambda _folder, keyword: dark_hdr if keyword.lower() == "darkref" else white_hdr)
+
+    def _open_stub(hdr_path, _raw_path):
+        if "darkref" in hdr_path:
+            return _DummyEnviImage(dark)
+        if "whiteref" in hdr_path:
+            return _DummyEnviImage(white)
+        return _DummyEnviImage(data, metadata={"wavelength": [400, 500, 600, 700]})
+
+    monkeypatch.setattr(hsi_loader.envi, "open", _open_stub)
+
+    corrected, wavelengths, warning = hsi_loader.load_hsi(
+        str(tmp_path),
+        window={"x0": 1, "x1": 5, "y0": 2},
+        spatial_step=2,
+        wavelength_range=(450, 700),
+        spectral_step=2,
+    )
+
+    expected = data[2::2, 1:5:2][:, :, [1, 3]] / 1000.0
+    assert corrected.shape == (2, 2, 2)
+    assert np.allclose(corrected, expected)
+    assert wavelengths == [500.0, 700.0]
+    assert warning is None
+
+
+def test_percentile_contrast_stretch_from_band_statistics():
+    band = np.linspace(0.0, 1.0, 1001, dtype=np.float32).reshape(1, 1001, 1)
+
+    stats = hsi_loader.compute_band_statistics(band, bins=100)
+
+    assert np.isclose(hsi_loader.stats_percentile(stats, 0, 50.0), 0.5, atol=0.01)
+    assert np.isclose(hsi_loader.stats_percentile(stats, 0, 2.0), 0.02, atol=0.01)
+
+    rgb = hsi_loader.extract_rgb(np.repeat(band, 3, axis=2), [0, 1, 2], bounds=[(0.25, 0.75)] * 3)
+    assert rgb[0, 250, 0] == 0
+    assert rgb[0, 750, 0] == 255
+
+
+@pytest.mark.parametrize("interleave", ["bsq", "bil", "bip"])
+def test_read_window_follows_the_file_interleave(monkeypatch, tmp_path, interleave):
+    data = np.arange(9 * 7 * 6, dtype=np.float32).reshape(9, 7, 6)
+    hdr = tmp_path / f"scene_{interleave}.hdr"
+    envi.save_image(str(hdr), data, interleave=interleave, ext=".raw")
+    image = envi.open(str(hdr), str(tmp_path / f"scene_{interleave}.raw"))
+    # The memory-mapped path must be taken, not the full-load fallback.
+    monkeypatch.setattr(image, "load", lambda *_args, **_kwargs: pytest.fail("full load"))
+
+    rows, cols, bands = hsi_loader._resolve_window(
+        data.shape,
+        None,
+        window={"x0": 1, "x1": 6, "y0": 2, "y1": 9},
+        spatial_step=2,
+        bands=[0, 2, 3, 5],
+    )
+    assert isinstance(bands, np.ndarray)
+    window = hsi_loader._read_window(image, rows, cols, bands)
+    assert np.array_equal(window, data[2:9:2, 1:6:2][:, :, [0, 2, 3, 5]])
@@ -0,0 +1,180 @@
+import numpy as np
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+from fastapi.testclient import TestClient
+
+
+mock_cv2 = types.ModuleType("cv2")
+
+
+def _imencode_stub(*_args, **_kwargs):
+    return True, np.array([], dtype=np.uint8)
+
+
+mock_cv2.imencode = _imencode_stub
+mock_cv2.cvtColor = lambda image, _code: image
+mock_cv2.COLOR_RGB2BGR = 4
+sys.modules.setdefault("cv2", mock_cv2)
+
+
+from main import app
+import main
+import preprocessing
+from preprocessing import normalize_pipeline, run_pipeline
+
+
+client = TestClient(app)
+
+
+def setup_module(_module):
+    rng = np.random.default_rng(1)
+    main.CUBE = rng.uniform(0.1, 0.9, size=(6, 8, 30)).astype(np.float32)
+    main.BANDS = [400.0 + 10.0 * i for i in range(30)]
+    main._reset_dataset_caches()
+
+
+def teardown_module(_module):
+    main.CUBE = None
+    main.BANDS = None
+    main.PIPELINES.clear()
+    main._reset_dataset_caches()
+
+
+def test_derivative_is_exact_on_quadratic_spectra():
+    wavelengths = [500.0 + 5.0 * i for i in range(21)]
+    x = np.asarray(wavelengths)
+    cube = np.broadcast_to(0.001 * (x - 550.0) ** 2, (2, 3, 21)).astype(np.float32)
+    stages = normalize_pipeline([{"op": "derivative", "window": 5, "polyorder": 2}])
+    result, bands = run_pipeline(cube, wavelengths, stages)
+    # Edge bands are padded, so only the interior is an exact fit.
+    assert np.allclose(result[:, :, 2:-2], 0.002 * (x[2:-2] - 550.0), atol=1e-4)
+    assert bands == wavelengths
+
+
+def test_continuum_removal_touches_one_on_the_hull():
+    wavelengths = list(range(12))
+    spectrum = np.array([0.5, 0.6, 0.4, 0.3, 0.7, 0.65, 0.2, 0.5, 0.8, 0.6, 0.55, 0.4])
+    cube = spectrum.reshape(1, 1, -1).astype(np.float32)
+    result, _ = run_pipeline(cube, wavelengths, [{"op": "continuum_removal"}])
+    values = result[0, 0]
+    assert np.all(values <= 1.0 + 1e-6)
+    for hull_point in (0, 1, 4, 8, 11):
+        assert np.isclose(values[hull_point], 1.0)
+    assert values[6] < 0.5
+
+
+def test_snv_and_bad_band_removal():
+    stages = normalize_pipeline(
+        [{"op": "remove_bands", "bands": [0], "ranges": [[480, 500]]}, {"op": "snv"}]
+    )
+    result, bands = run_pipeline(main.CUBE, main.BANDS, stages)
+    assert result.shape == (6, 8, 26)
+    assert 400.0 not in bands and 490.0 not in bands
+    assert np.allclose(result.mean(axis=2), 0.0, atol=1e-5)
+    assert np.allclose(result.std(axis=2), 1.0, atol=1e-4)
+
+
+def test_shared_prefix_is_computed_once(monkeypatch):
+    calls = []
+    original = preprocessing._STAGE_FUNCTIONS["smooth"]
+
+    def counting(cube, wavelengths, stage):
+        calls.append(stage["op"])
+        return original(cube, wavelengths, stage)
+
+    monkeypatch.setitem(preprocessing._STAGE_FUNCTIONS, "smooth", counting)
+    cache = OrderedDict()
+    smooth = {"op": "smooth", "window": 5, "polyorder": 2}
+    run_pipeline(main.CUBE, main.BANDS, normalize_pipeline([smooth]), cache)
+    run_pipeline(main.CUBE, main.BANDS, normalize_pipeline([smooth, {"op": "snv"}]), cache)
+    assert calls == ["smooth"]
+    assert len(cache) == 2
+
+
+def test_invalid_stage_is_rejected():
+    response = client.post("/pipelines", json={"stages": [{"op": "sharpen"}]})
+    assert response.status_code == 400
+    assert "Unsupported preprocessing stage" in response.json()["error"]
+
+
+def test_endpoints_share_a_registered_pipeline():
+    response = client.post(
+        "/pipelines",
+        json={"stages": [{"op": "remove_bands", "bands": [0, 1]}, {"op": "snv"}]},
+    )
+    assert response.status_code == 200
+    pipeline_id = response.json()["id"]
+
+    spectra = client.post(
+        "/spectra",
+        json={"rect": {"x0": 0, "y0": 0, "x1": 2, "y1": 2}, "pipeline": pipeline_id},
+    ).json()
+    assert len(spectra["spectra"]) == 28
+    assert spectra["bands"][0] == 420.0
+
+    view = main.PIPELINE_VIEWS[pipeline_id]
+    kmeans = client.post(
+        "/analysis", json={"method": "kmeans", "clusters": 2, "pipeline": pipeline_id}
+    )
+    assert kmeans.status_code == 200
+    assert main.PIPELINE_VIEWS[pipeline_id] is view
+
+    unknown = client.post("/analysis", json={"method": "pca", "pipeline": "missing"})
+    assert unknown.status_code == 400
+
+
+def test_concurrent_requests_build_a_view_once(monkeypatch):
+    calls = []
+    original = main.run_pipeline
+
+    def slow(*args, **kwargs):
+        calls.append(args[2])
+        time.sleep(0.05)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(main, "run_pipeline", slow)
+    stages = normalize_pipeline([{"op": "continuum_removal"}])
+    views = []
+    threads = [
+        threading.Thread(target=lambda: views.append(main._get_pipeline_view(stages)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert all(view is views[0] for view in views)
+
+
+def test_pipeline_registry_is_bounded(monkeypatch):
+    monkeypatch.setattr(main, "PIPELINE_REGISTRY_SIZE", 3)
+    ids = []
+    for window in (3, 5, 7, 9):
+        stages = [{"op": "smooth", "window": window, "polyorder": 1}]
+        ids.append(client.post("/pipelines", json={"stages": stages}).json()["id"])
+    assert list(main.PIPELINES) == ids[1:]
+    missing = client.post("/analysis", json={"method": "pca", "pipeline": ids[0]})
+    assert missing.status_code == 400
+
+
+def test_memo_lookups_and_inserts_take_the_given_lock():
+    lock = threading.Lock()
+    cache = OrderedDict()
+    stages = normalize_pipeline([{"op": "snv"}])
+    finished = threading.Event()
+
+    def run():
+        run_pipeline(main.CUBE, main.BANDS, stages, cache, lock=lock)
+        finished.set()
+
+    with lock:
+        worker = threading.Thread(target=run)
+        worker.start()
+        assert not finished.wait(0.1)
+        assert not cache
+    worker.join()
+    assert finished.is_set() and len(cache) == 1
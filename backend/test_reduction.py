@@ -0,0 +1,113 @@
+import numpy as np
+import sys
+import types
+from fastapi.testclient import TestClient
+
+
+mock_cv2 = types.ModuleType("cv2")
+
+
+def _imencode_stub(*_args, **_kwargs):
+    return True, np.array([], dtype=np.uint8)
+
+
+mock_cv2.imencode = _imencode_stub
+mock_cv2.cvtColor = lambda image, _code: image
+mock_cv2.COLOR_RGB2BGR = 4
+sys.modules.setdefault("cv2", mock_cv2)
+
+
+from main import app
+import main
+
+
+def setup_module(_module):
+    # Mixtures of two endmembers over 40 bands: rank two plus small noise
+    rng = np.random.default_rng(0)
+    bands = np.linspace(0.0, 1.0, 40)
+    first = 0.2 + 0.6 * bands
+    second = 0.8 - 0.5 * bands
+    weights = np.zeros((8, 10), dtype=np.float32)
+    weights[4:] = 1.0
+    cube = weights[..., None] * first + (1.0 - weights[..., None]) * second
+    cube += rng.normal(scale=1e-3, size=cube.shape)
+    main.CUBE = cube.astype(np.float32)
+    main.BANDS = list(range(40))
+    main._reset_dataset_caches()
+
+
+def teardown_module(_module):
+    main.CUBE = None
+    main.BANDS = None
+    main._reset_dataset_caches()
+
+
+client = TestClient(app)
+
+
+def test_pca_reduction_is_cached_and_retains_variance():
+    reduced = main._get_reduced_cube("pca", 3)
+    assert reduced["pixels"].shape == (80, 3)
+    assert reduced["retained_variance"] > 0.99
+    assert main._get_reduced_cube("pca", 3) is reduced
+    assert main.PCA_BASIS is not None
+
+
+def test_binning_reduction_uses_orthonormal_groups():
+    reduced = main._get_reduced_cube("binning", 4)
+    projection = reduced["projection"]
+    assert projection.shape == (40, 4)
+    assert np.allclose(projection.T @ projection, np.eye(4), atol=1e-6)
+
+
+def test_kmeans_in_reduced_space_matches_full_space():
+    payload = {"method": "kmeans", "clusters": 2, "reduction": {"method": "pca", "dims": 3}}
+    res = client.post("/analysis", json=payload)
+    assert res.status_code == 200
+    data = res.json()
+    assert data["reduction"]["dims"] == 3
+    assert data["reduction"]["retained_variance"] > 0.99
+    full = main._compute_kmeans_segmentation(main.CUBE, 2)
+    reduced_counts = sorted(s["count"] for s in data["cluster_summaries"])
+    assert reduced_counts == sorted(s["count"] for s in full["cluster_summaries"])
+
+
+def test_sam_in_reduced_space_reports_full_spectra():
+    annotations = [
+        {"label": "first", "rect": {"x0": 0, "y0": 5, "x1": 3, "y1": 8}},
+        {"label": "second", "rect": {"x0": 0, "y0": 0, "x1": 3, "y1": 3}},
+    ]
+    payload = {"annotations": annotations, "reduction": {"method": "pca", "dims": 3}}
+    res = client.post("/supervised", json=payload)
+    assert res.status_code == 200
+    classes = {c["label"]: c for c in res.json()["classes"]}
+    assert classes["first"]["classified"]["pixels"] == 40
+    assert classes["second"]["classified"]["pixels"] == 40
+    assert len(classes["first"]["classified"]["spectra"]) == 40
+
+
+def test_invalid_reduction_is_rejected():
+    payload = {"method": "kmeans", "reduction": {"method": "wavelet"}}
+    res = client.post("/analysis", json=payload)
+    assert res.status_code == 400
+
+
+def test_reduced_kmeans_reports_true_centroid_spectra():
+    reduced = main._get_reduced_cube("binning", 2)
+    result = main._compute_kmeans_segmentation(main.CUBE, 2, reduced=reduced)
+    expected = sorted(
+        float(main.CUBE[:4].mean()) if half == 0 else float(main.CUBE[4:].mean())
+        for half in (0, 1)
+    )
+    means = sorted(summary["mean"] for summary in result["cluster_summaries"])
+    assert np.allclose(means, expected, atol=1e-5)
+    # Binned centers are flat within each bin; real spectra peak at the ends.
+    peaks = sorted(summary["peak_band_index"] for summary in result["cluster_summaries"])
+    assert peaks == [0, 39]
+
+
+def test_reduced_cube_cache_is_bounded():
+    for dims in range(1, main.REDUCED_CACHE_SIZE + 3):
+        main._get_reduced_cube("binning", dims)
+    assert len(main.REDUCED_CUBES) == main.REDUCED_CACHE_SIZE
+    assert ("binning", 1) not in main.REDUCED_CUBES
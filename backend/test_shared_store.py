@@ -0,0 +1,103 @@
+import numpy as np
+import sys
+import types
+from fastapi.testclient import TestClient
+
+
+mock_cv2 = types.ModuleType("cv2")
+
+
+def _imencode_stub(*_args, **_kwargs):
+    return True, np.array([], dtype=np.uint8)
+
+
+mock_cv2.imencode = _imencode_stub
+mock_cv2.cvtColor = lambda image, _code: image
+mock_cv2.COLOR_RGB2BGR = 4
+sys.modules.setdefault("cv2", mock_cv2)
+
+
+import main
+import shared_store
+
+
+def teardown_function(_function):
+    main.CUBE = None
+    main.BANDS = None
+    main.DATASET_GENERATION = None
+    main.REGISTRY_MTIME = None
+    main._reset_dataset_caches()
+
+
+def test_published_cube_is_mapped_not_copied(tmp_path):
+    cube = np.arange(2 * 3 * 4, dtype=np.float32).reshape(2, 3, 4)
+    stats = main.compute_band_statistics(cube)
+
+    generation, mapped = shared_store.publish_dataset(tmp_path, cube, [1, 2, 3, 4], None, stats)
+    entry = shared_store.read_registry(tmp_path)
+    attached, bands, warning, attached_stats = shared_store.attach_dataset(tmp_path, entry)
+
+    assert entry["generation"] == generation
+    assert isinstance(mapped, np.memmap) and isinstance(attached, np.memmap)
+    assert np.array_equal(attached, cube)
+    assert bands == [1, 2, 3, 4]
+    assert warning is None
+    assert np.array_equal(attached_stats["histogram"], stats["histogram"])
+
+
+def test_old_generations_are_pruned(tmp_path):
+    cube = np.zeros((1, 1, 2), dtype=np.float32)
+    generations = [shared_store.publish_dataset(tmp_path, cube, [0, 1])[0] for _ in range(3)]
+
+    remaining = {path.name.split(".", 1)[0] for path in tmp_path.glob("*.npy")}
+    assert remaining == set(generations[1:])
+
+
+def test_pruning_keeps_the_configured_number_of_generations(monkeypatch, tmp_path):
+    monkeypatch.setattr(shared_store, "KEEP_GENERATIONS", 3)
+    cube = np.zeros((1, 1, 2), dtype=np.float32)
+    generations = [shared_store.publish_dataset(tmp_path, cube, [0, 1])[0] for _ in range(5)]
+
+    remaining = {path.name.split(".", 1)[0] for path in tmp_path.glob("*.npy")}
+    assert remaining == set(generations[2:])
+
+
+def test_shared_dir_is_created_once(monkeypatch, tmp_path):
+    target = tmp_path / "shared"
+    monkeypatch.setenv(shared_store.SHARED_DIR_ENV, str(target))
+    first = shared_store.shared_dir()
+    assert first.is_dir()
+    assert shared_store.shared_dir() is first
+
+
+def test_worker_adopts_dataset_published_by_another_worker(monkeypatch, tmp_path):
+    monkeypatch.setenv(shared_store.SHARED_DIR_ENV, str(tmp_path))
+    cube = np.full((2, 2, 3), 0.5, dtype=np.float32)
+    generation, _ = shared_store.publish_dataset(tmp_path, cube, [400, 500, 600])
+
+    main._sync_shared_dataset()
+
+    assert main.DATASET_GENERATION == generation
+    assert main.BANDS == [400, 500, 600]
+    assert np.array_equal(main.CUBE, cube)
+
+
+def test_failed_attach_is_retried_on_the_next_request(monkeypatch, tmp_path):
+    monkeypatch.setenv(shared_store.SHARED_DIR_ENV, str(tmp_path))
+    main.CUBE = np.zeros((1, 1, 2), dtype=np.float32)
+    cube = np.full((2, 2, 3), 0.5, dtype=np.float32)
+    generation, mapped = shared_store.publish_dataset(tmp_path, cube, [400, 500, 600])
+    del mapped
+    # Simulate the generation being pruned before this worker attaches.
+    (tmp_path / f"{generation}.cube.npy").unlink()
+
+    response = TestClient(main.app).get("/health")
+    assert response.status_code == 200
+    assert main.DATASET_GENERATION is None
+    assert main.REGISTRY_MTIME is None
+    assert main.CUBE.shape == (1, 1, 2)
+
+    generation, _ = shared_store.publish_dataset(tmp_path, cube, [400, 500, 600])
+    main._sync_shared_dataset()
+    assert main.DATASET_GENERATION == generation
+    assert main.CUBE.shape == (2, 2, 3)
@@ -12,6 +12,8 @@ def _imencode_stub(*_args, **_kwargs):
 
 
 mock_cv2.imencode = _imencode_stub
+mock_cv2.cvtColor = lambda image, _code: image
+mock_cv2.COLOR_RGB2BGR = 4
 sys.modules.setdefault("cv2", mock_cv2)
 
 
@@ -24,11 +26,13 @@ def setup_module(_module):
     cube = np.arange(4 * 4 * 3, dtype=float).reshape((4, 4, 3))
     main.CUBE = cube
     main.BANDS = [500, 600, 700]
+    main._reset_dataset_caches()
 
 
 def teardown_module(_module):
     main.CUBE = None
     main.BANDS = None
+    main._reset_dataset_caches()
 
 
 client = TestClient(app)
@@ -60,3 +64,31 @@ def test_empty_selection_rejected():
     res = client.post("/spectra", json=payload)
     assert res.status_code == 400
     assert res.json()["error"] == "Empty selection"
+
+
+def test_pixel_probe_returns_contiguous_float32_spectrum():
+    res = client.get("/pixel", params={"x": 2, "y": 1})
+    assert res.status_code == 200
+    assert res.headers["x-bands"] == "3"
+    spectrum = np.frombuffer(res.content, dtype="<f4")
+    assert spectrum.tolist() == main.CUBE[1, 2, :].tolist()
+
+
+def test_pixel_probe_tile_is_clipped_to_image():
+    res = client.get("/pixel/tile", params={"x": 0, "y": 3, "radius": 1})
+    assert res.status_code == 200
+    height = int(res.headers["x-tile-height"])
+    width = int(res.headers["x-tile-width"])
+    assert (res.headers["x-tile-x0"], res.headers["x-tile-y0"]) == ("0", "2")
+    tile = np.frombuffer(res.content, dtype="<f4").reshape(height, width, 3)
+    assert np.array_equal(tile, main.CUBE[2:4, 0:2, :])
+
+
+def test_pixel_probe_websocket_streams_binary_spectra():
+    with client.websocket_connect("/ws/pixel") as ws:
+        ws.send_text("3,3")
+        spectrum = np.frombuffer(ws.receive_bytes(), dtype="<f4")
+        ws.send_text("9,9")
+        error = ws.receive_json()
+    assert spectrum.tolist() == main.CUBE[3, 3, :].tolist()
+    assert error["error"] == "Pixel out of range"
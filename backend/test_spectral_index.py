@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+import sys
+import types
+from fastapi.testclient import TestClient
+
+
+mock_cv2 = types.ModuleType("cv2")
+
+
+def _imencode_stub(*_args, **_kwargs):
+    return True, np.array([], dtype=np.uint8)
+
+
+mock_cv2.imencode = _imencode_stub
+mock_cv2.cvtColor = lambda image, _code: image
+mock_cv2.COLOR_RGB2BGR = 4
+sys.modules.setdefault("cv2", mock_cv2)
+
+
+from main import app
+import main
+import spectral_index
+
+
+client = TestClient(app)
+
+
+WAVELENGTHS = [550.0, 670.0, 800.0]
+
+
+def test_expression_is_compiled_once_and_cached():
+    spectral_index.compile_expression.cache_clear()
+    first = spectral_index.compile_expression("(R800 - R670) / (R800 + R670)")
+    second = spectral_index.compile_expression("(R800 - R670) / (R800 + R670)")
+    assert first is second
+    assert first[1] == ("R800", "R670")
+    assert spectral_index.compile_expression.cache_info().hits == 1
+
+
+def test_evaluate_index_matches_numpy_in_chunks():
+    rng = np.random.default_rng(0)
+    cube = rng.uniform(0.1, 1.0, size=(9, 7, 3)).astype(np.float32)
+
+    values, band_map = spectral_index.evaluate_index(
+        cube, WAVELENGTHS, "(R800 - R671) / (R800 + R671) + sqrt(B0)", chunk_elements=10
+    )
+
+    expected = (cube[:, :, 2] - cube[:, :, 1]) / (cube[:, :, 2] + cube[:, :, 1]) + np.sqrt(cube[:, :, 0])
+    assert band_map == {"R800": 2, "R671": 1, "B0": 0}
+    assert np.allclose(values, expected)
+
+
+@pytest.mark.parametrize(
+    "expression",
+    ["__import__('os')", "R800.real", "R800 if R670 else R550", "foo(R800)", "X12 + 1", "2 + 3"],
+)
+def test_rejects_unsafe_or_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        spectral_index.compile_expression(expression)
+
+
+def test_wavelength_outside_sampled_range_is_rejected():
+    with pytest.raises(ValueError):
+        spectral_index.resolve_band_references(["R1600"], WAVELENGTHS)
+
+
+@pytest.mark.parametrize("expression", [["B1"], {"B": 1}, 3])
+def test_index_endpoint_rejects_non_string_expressions(monkeypatch, expression):
+    monkeypatch.setattr(main, "CUBE", np.ones((2, 2, 3), dtype=np.float32))
+    monkeypatch.setattr(main, "BANDS", WAVELENGTHS)
+    main._reset_dataset_caches()
+    try:
+        res = client.post("/index", json={"expression": expression})
+    finally:
+        monkeypatch.undo()
+        main._reset_dataset_caches()
+    assert res.status_code == 400
+    assert res.json()["error"] == "Index expression must be a string."
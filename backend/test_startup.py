@@ -0,0 +1,114 @@
+import numpy as np
+import os
+import sys
+import types
+from fastapi.testclient import TestClient
+
+
+mock_cv2 = types.ModuleType("cv2")
+
+
+def _imencode_stub(*_args, **_kwargs):
+    return True, np.array([], dtype=np.uint8)
+
+
+mock_cv2.imencode = _imencode_stub
+mock_cv2.cvtColor = lambda image, _code: image
+mock_cv2.COLOR_RGB2BGR = 4
+sys.modules.setdefault("cv2", mock_cv2)
+
+
+from main import app
+import main
+import shared_store
+from lazy_import import LazyModule
+
+
+client = TestClient(app)
+
+
+def teardown_function(_function):
+    main.CUBE = None
+    main.BANDS = None
+    main.ACTIVE_PRELOAD = None
+    main.DATASET_GENERATION = None
+    main.REGISTRY_MTIME = None
+    main.PRELOADED.clear()
+    main.PRELOAD_STATUS.clear()
+    main._reset_dataset_caches()
+
+
+def test_lazy_module_imports_on_first_attribute_access():
+    module = LazyModule("json")
+    assert not module.loaded
+    assert module.dumps([1]) == "[1]"
+    assert module.loaded
+
+
+def test_health_is_available_without_a_dataset():
+    res = client.get("/health")
+    assert res.status_code == 200
+    assert res.json() == {"status": "ok"}
+
+
+def test_preload_warms_caches_and_serves_load_from_memory(monkeypatch, tmp_path):
+    cube = np.linspace(0.0, 1.0, 4 * 4 * 3, dtype=np.float32).reshape(4, 4, 3)
+    calls = []
+
+    def _load_stub(path, **_kwargs):
+        calls.append(path)
+        return cube, [400.0, 500.0, 600.0], None
+
+    monkeypatch.setattr(main, "load_hsi", _load_stub)
+    monkeypatch.setenv(main.PRELOAD_ENV, str(tmp_path))
+    main.PRELOAD_STATUS[str(tmp_path)] = "loading"
+    assert client.get("/ready").status_code == 503
+
+    main._start_preload().join(timeout=5)
+
+    ready = client.get("/ready")
+    assert ready.status_code == 200
+    assert ready.json()["preload"] == {str(tmp_path): "ready"}
+    assert main.CUBE is cube
+    assert main.PCA_BASIS is not None and main.STATS is not None
+    assert (2, 2, 2, "none") in main.RGB_CACHE
+
+    # The activated dataset is owned by CUBE now, not kept twice.
+    assert main.PRELOADED == {}
+
+    res = client.post("/load", data={"folder_path": str(tmp_path)})
+    assert res.status_code == 200
+    assert res.json()["shape"] == [4, 4, 3]
+    assert calls == [str(tmp_path)]
+
+
+def test_preload_does_not_replace_a_dataset_loaded_meanwhile(monkeypatch, tmp_path):
+    user_cube = np.zeros((2, 2, 3), dtype=np.float32)
+
+    def _load_stub(path, **_kwargs):
+        # A user /load finishes while the preload is still warming.
+        main.CUBE = user_cube
+        return np.ones((4, 4, 3), dtype=np.float32), [400.0, 500.0, 600.0], None
+
+    monkeypatch.setattr(main, "load_hsi", _load_stub)
+    monkeypatch.setenv(main.PRELOAD_ENV, str(tmp_path))
+    main._start_preload().join(timeout=5)
+
+    assert main.CUBE is user_cube
+    assert list(main.PRELOADED) == [os.path.realpath(str(tmp_path))]
+
+
+def test_shared_preload_is_published_and_not_kept_privately(monkeypatch, tmp_path):
+    shared = tmp_path / "shared"
+    first, second = tmp_path / "first", tmp_path / "second"
+    cube = np.linspace(0.0, 1.0, 4 * 4 * 3, dtype=np.float32).reshape(4, 4, 3)
+    monkeypatch.setattr(main, "load_hsi", lambda *_a, **_k: (cube, [1.0, 2.0, 3.0], None))
+    monkeypatch.setenv(shared_store.SHARED_DIR_ENV, str(shared))
+    monkeypatch.setenv(main.PRELOAD_ENV, os.pathsep.join([str(first), str(second)]))
+
+    main._start_preload().join(timeout=5)
+
+    assert isinstance(main.CUBE, np.memmap)
+    assert shared_store.read_registry(shared)["source"] == os.path.realpath(str(first))
+    assert main.PRELOADED == {}
+    assert main.PRELOAD_STATUS[str(second)].startswith("skipped")
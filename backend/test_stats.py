@@ -0,0 +1,100 @@
+import numpy as np
+import sys
+import types
+from fastapi.testclient import TestClient
+
+
+mock_cv2 = types.ModuleType("cv2")
+
+
+def _imencode_stub(*_args, **_kwargs):
+    return True, np.array([], dtype=np.uint8)
+
+
+mock_cv2.imencode = _imencode_stub
+mock_cv2.cvtColor = lambda image, _code: image
+mock_cv2.COLOR_RGB2BGR = 4
+sys.modules.setdefault("cv2", mock_cv2)
+
+
+from main import app
+import main
+
+
+def setup_module(_module):
+    cube = np.linspace(0.0, 1.0, 5 * 4 * 2, dtype=np.float32).reshape((5, 4, 2))
+    cube[0, 0, 1] = np.nan
+    main.CUBE = cube
+    main.BANDS = [500, 600]
+    main._reset_dataset_caches()
+
+
+def teardown_module(_module):
+    main.CUBE = None
+    main.BANDS = None
+    main._reset_dataset_caches()
+
+
+client = TestClient(app)
+
+
+def test_stats_endpoint_reports_per_band_statistics():
+    res = client.get("/stats")
+    assert res.status_code == 200
+    data = res.json()
+    cube = main.CUBE
+    assert data["bands"] == [500, 600]
+    assert data["count"] == [20, 19]
+    assert np.allclose(data["min"], np.nanmin(cube, axis=(0, 1)))
+    assert np.allclose(data["max"], np.nanmax(cube, axis=(0, 1)))
+    assert np.allclose(data["mean"], np.nanmean(cube, axis=(0, 1)), atol=1e-6)
+    assert np.allclose(data["std"], np.nanstd(cube, axis=(0, 1)), atol=1e-6)
+    assert [sum(counts) for counts in data["histogram"]["counts"]] == [20, 19]
+
+
+def test_stats_are_computed_once_and_reused():
+    client.get("/stats")
+    cached = main.STATS
+    client.get("/stats", params={"histogram": False})
+    assert main.STATS is cached
+
+
+def test_rgb_percentile_stretch_uses_cached_stats(monkeypatch):
+    main._reset_dataset_caches()
+    scans = []
+    bounds_seen = []
+    original_stats = main.compute_band_statistics
+    original_rgb = main.extract_rgb
+
+    def counting_stats(cube):
+        scans.append(cube.shape)
+        return original_stats(cube)
+
+    def recording_rgb(cube, idxs, bounds=None):
+        bounds_seen.append(bounds)
+        return original_rgb(cube, idxs, bounds=bounds)
+
+    monkeypatch.setattr(main, "compute_band_statistics", counting_stats)
+    monkeypatch.setattr(main, "extract_rgb", recording_rgb)
+    for low in (2, 5):
+        params = {"r": 0, "g": 1, "b": 0, "stretch": "percentile", "low": low}
+        assert client.get("/rgb", params=params).status_code == 200
+    assert client.get("/stats").status_code == 200
+
+    assert len(scans) == 1
+    stats = main.STATS
+    expected = [
+        (main.stats_percentile(stats, idx, 5.0), main.stats_percentile(stats, idx, 98.0))
+        for idx in (0, 1, 0)
+    ]
+    assert bounds_seen[-1] == expected
+    res = client.get("/rgb", params={"stretch": "gamma"})
+    assert res.status_code == 400
+
+
+def test_rgb_cache_is_bounded_under_percentile_sweeps():
+    for low in range(main.RGB_CACHE_SIZE + 5):
+        params = {"r": 0, "g": 1, "b": 0, "stretch": "percentile", "low": low}
+        assert client.get("/rgb", params=params).status_code == 200
+    assert len(main.RGB_CACHE) == main.RGB_CACHE_SIZE
+    assert (0, 1, 0, "percentile", 0.0, 98.0) not in main.RGB_CACHE
@@ -0,0 +1,134 @@
+import numpy as np
+import sys
+import types
+import warnings
+from fastapi.testclient import TestClient
+
+
+mock_cv2 = types.ModuleType("cv2")
+
+
+def _imencode_stub(*_args, **_kwargs):
+    return True, np.array([], dtype=np.uint8)
+
+
+mock_cv2.imencode = _imencode_stub
+mock_cv2.cvtColor = lambda image, _code: image
+mock_cv2.COLOR_RGB2BGR = 4
+sys.modules.setdefault("cv2", mock_cv2)
+
+
+from main import app
+import main
+
+
+def setup_module(_module):
+    # Two well separated spectral populations split by row
+    cube = np.zeros((6, 4, 3), dtype=np.float32)
+    cube[:3] = [1.0, 0.1, 0.1]
+    cube[3:] = [0.1, 0.1, 1.0]
+    main.CUBE = cube
+    main.BANDS = [500, 600, 700]
+    main._reset_dataset_caches()
+
+
+def teardown_module(_module):
+    main.CUBE = None
+    main.BANDS = None
+    main._reset_dataset_caches()
+
+
+client = TestClient(app)
+
+
+def test_kmeans_stream_reports_iterations_then_result():
+    with client.websocket_connect("/ws/analysis") as ws:
+        ws.send_json({"method": "kmeans", "clusters": 2})
+        events = []
+        while True:
+            event = ws.receive_json()
+            events.append(event)
+            if event["type"] in {"result", "error", "stopped"}:
+                break
+
+    assert events[-1]["type"] == "result"
+    iterations = [event for event in events if event["type"] == "iteration"]
+    assert iterations
+    assert all("center_shift" in event and "map" in event for event in iterations)
+    assert events[-1]["method"] == "kmeans"
+    assert events[-1]["iterations"] == len(iterations)
+    counts = sorted(summary["count"] for summary in events[-1]["cluster_summaries"])
+    assert counts == [12, 12]
+
+
+def test_sam_stream_emits_one_event_per_tile():
+    annotations = [
+        {"label": "top", "rect": {"x0": 0, "y0": 0, "x1": 2, "y1": 2}},
+        {"label": "bottom", "rect": {"x0": 0, "y0": 4, "x1": 2, "y1": 6}},
+    ]
+    with client.websocket_connect("/ws/analysis") as ws:
+        ws.send_json({"method": "sam", "annotations": annotations, "tile_rows": 2})
+        events = []
+        while True:
+            event = ws.receive_json()
+            events.append(event)
+            if event["type"] in {"result", "error", "stopped"}:
+                break
+
+    tiles = [event for event in events if event["type"] == "tile"]
+    assert [tile["rows"] for tile in tiles] == [[0, 2], [2, 4], [4, 6]]
+    result = events[-1]
+    assert result["type"] == "result"
+    assert result["method"] == "sam"
+    assert {c["label"]: c["classified"]["pixels"] for c in result["classes"]} == {
+        "top": 12,
+        "bottom": 12,
+    }
+
+
+def test_stream_rejects_unknown_method():
+    with client.websocket_connect("/ws/analysis") as ws:
+        ws.send_json({"method": "pca"})
+        event = ws.receive_json()
+    assert event["type"] == "error"
+
+
+def test_stopped_kmeans_returns_current_centers():
+    stop_after = iter([False, True])
+    steps = main._iter_kmeans_segmentation(main.CUBE, 2, should_stop=lambda: next(stop_after))
+    result = main._run_to_completion(steps)
+    assert result["iterations"] == 1
+    assert len(result["cluster_summaries"]) == 2
+
+
+def test_sam_zero_norm_pixels_get_a_deterministic_label():
+    cube = main.CUBE.copy()
+    cube[4, 3] = np.nan
+    annotations = [
+        {"label": "top", "rect": {"x0": 0, "y0": 0, "x1": 2, "y1": 2}},
+        {"label": "bottom", "rect": {"x0": 0, "y0": 4, "x1": 2, "y1": 6}},
+    ]
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        result = main._classify_with_sam(cube, annotations)
+    counts = {c["label"]: c["classified"]["pixels"] for c in result["classes"]}
+    # All angles are equal for an empty spectrum, so it falls to the first class.
+    assert counts == {"top": 13, "bottom": 11}
+
+
+def test_plain_requests_only_encode_the_final_map(monkeypatch):
+    encoded = []
+    original = main._encode_rgb_image
+
+    def counting(image):
+        encoded.append(image.shape)
+        return original(image)
+
+    monkeypatch.setattr(main, "_encode_rgb_image", counting)
+    main._compute_kmeans_segmentation(main.CUBE, 2)
+    annotations = [
+        {"label": "top", "rect": {"x0": 0, "y0": 0, "x1": 2, "y1": 2}},
+        {"label": "bottom", "rect": {"x0": 0, "y0": 4, "x1": 2, "y1": 6}},
+    ]
+    main._classify_with_sam(main.CUBE, annotations)
+    assert encoded == [(6, 4, 3), (6, 4, 3)]
@@ -1,12 +1,22 @@
 const API = "http://127.0.0.1:8000";
 
-export async function getRGB(idxs) {
+export async function getRGB(idxs, options = {}) {
   const [r, g, b] = idxs;
-  const res = await fetch(`${API}/rgb?r=${r}&g=${g}&b=${b}`);
+  const params = new URLSearchParams({ r, g, b, ...options });
+  const res = await fetch(`${API}/rgb?${params.toString()}`);
   const data = await res.json();
   return data.image;
 }
 
+export async function getStats(includeHistogram = true) {
+  const res = await fetch(`${API}/stats?histogram=${includeHistogram}`);
+  const data = await res.json();
+  if (data.error) {
+    throw new Error(data.error);
+  }
+  return data;
+}
+
 export async function runAnalysis(method, params = {}) {
   const payload = { method, ...params };
   const res = await fetch(`${API}/analysis`, {
@@ -37,3 +47,97 @@ export async function runSupervisedClassification(payload) {
   }
   return data;
 }
+
+export function streamAnalysis(payload, onEvent) {
+  const socket = new WebSocket(`${API.replace(/^http/, "ws")}/ws/analysis`);
+  socket.onopen = () => socket.send(JSON.stringify(payload));
+  socket.onmessage = (message) => {
+    const event = JSON.parse(message.data);
+    onEvent(event);
+    if (["result", "stopped", "error"].includes(event.type)) {
+      socket.close();
+    }
+  };
+  return {
+    stop: () => {
+      if (socket.readyState === WebSocket.OPEN) {
+        socket.send(JSON.stringify({ action: "stop" }));
+      }
+    },
+    close: () => socket.close(),
+  };
+}
+
+export async function computeIndex(params) {
+  const res = await fetch(`${API}/index`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(params),
+  });
+  const data = await res.json();
+  if (data.error) {
+    throw new Error(data.error);
+  }
+  return data;
+}
+
+export async function getIndexPresets() {
+  const res = await fetch(`${API}/index/presets`);
+  const data = await res.json();
+  return data.presets;
+}
+
+export async function registerPipeline(stages) {
+  const res = await fetch(`${API}/pipelines`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ stages }),
+  });
+  const data = await res.json();
+  if (!res.ok) throw new Error(data.error);
+  return data.id;
+}
+
+export async function getPixelSpectrum(x, y) {
+  const res = await fetch(`${API}/pixel?x=${x}&y=${y}`);
+  if (!res.ok) {
+    const data = await res.json();
+    throw new Error(data.error);
+  }
+  return new Float32Array(await res.arrayBuffer());
+}
+
+export async function getPixelTile(x, y, radius = 4) {
+  const res = await fetch(`${API}/pixel/tile?x=${x}&y=${y}&radius=${radius}`);
+  if (!res.ok) {
+    const data = await res.json();
+    throw new Error(data.error);
+  }
+  const header = (name) => Number(res.headers.get(name));
+  return {
+    x0: header("X-Tile-X0"),
+    y0: header("X-Tile-Y0"),
+    width: header("X-Tile-Width"),
+    height: header("X-Tile-Height"),
+    bands: header("X-Bands"),
+    data: new Float32Array(await res.arrayBuffer()),
+  };
+}
+
+export function openPixelProbe(onSpectrum) {
+  const socket = new WebSocket(`${API.replace(/^http/, "ws")}/ws/pixel`);
+  socket.binaryType = "arraybuffer";
+  socket.onmessage = (message) => {
+    if (typeof message.data !== "string") {
+      onSpectrum(new Float32Array(message.data));
+    }
+  };
+  return {
+    probe: (x, y) => {
+      if (socket.readyState === WebSocket.OPEN) {
+        socket.send(`${x},${y}`);
+      }
+    },
+    close: () => socket.close(),
+  };
+}